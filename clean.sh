@@ -1,2 +1,3 @@
 #!/bin/bash
-rm results.csv compass.log entropy_file.csv envmondb/*COMPASS* envmondb/*full*
+rm -rf jobs cache
+rm results.csv compass.log entropy_file.csv entropy_file.csv.state envmondb/*COMPASS* envmondb/*full* compass_manifest.json confirmed_results.csv
@@ -0,0 +1,217 @@
+"""
+compass_benchmark.py
+Purpose: Reproducible COMPASS benchmark on synthetic tables shaped like the envmondb tables T1-T17.
+
+Every table is generated from a fixed seed with the column mix of its envmondb namesake (identifiers, timestamps,
+station and status categories, sensor readings, free text) and a size of scale times the envmondb file size. The
+benchmark runs the entropy, clustering and compression stages of compass_main.run_sweep on each table under
+compass_telemetry, and reports wall time, CPU time and peak memory growth per stage and the compressed bytes of every
+strategy. Results can be saved as a baseline and later runs compared with it: a stage that became slower than the
+tolerance allows, or a strategy whose compressed size changed, is flagged as a regression.
+
+Usage: compass_benchmark.py [--tables T1 T3 ...] [--scale 0.01] [--baseline FILE] [--save-baseline FILE]
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+import compass_main
+import compass_recording
+import compass_telemetry
+from compass_clean_silhouette_scores import file_sizes, file_mapping
+
+DEFAULT_SCALE = 0.01
+DEFAULT_TOLERANCE = 0.25
+# Stages faster than this are too noisy to flag
+MIN_FLAGGED_SECONDS = 0.05
+METRICS = ("wall_s", "cpu_s", "rss_growth_kb")
+
+# Column mix of each envmondb table: (kind, count, distinct values) with kind one of
+# id, timestamp, category, sensor, flag, text. MEASUREMENTS is the generic sensor table, also used for unknown names.
+MEASUREMENTS = [("id", 1, None), ("timestamp", 1, None), ("category", 1, 40), ("sensor", 6, None), ("flag", 2, 3)]
+COLUMN_MIXES = {
+    'measurements_basic.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 2, 60), ("sensor", 10, None),
+                               ("flag", 2, 3)],
+    'measurements_cut_processed.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 60),
+                                       ("sensor", 8, None), ("flag", 1, 2)],
+    'battery.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 200), ("sensor", 3, None)],
+    'location.csv': [("id", 1, None), ("category", 2, 500), ("sensor", 3, None), ("text", 2, 2000)],
+    'sensors.csv': [("id", 1, None), ("category", 3, 30), ("text", 2, 300), ("flag", 1, 2)],
+    'microcontrollers.csv': [("id", 1, None), ("category", 2, 10), ("text", 1, 50)],
+    'station_status.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 20), ("flag", 2, 4)],
+    'measurements_meteorology.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 40), ("sensor", 8, None),
+                                     ("flag", 1, 3)],
+    'measurements_dust.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 30), ("sensor", 4, None),
+                              ("flag", 1, 2)],
+    'measurements_airquality.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 25), ("sensor", 6, None),
+                                    ("flag", 2, 3)],
+    'measurements_oil_detectors.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 15),
+                                       ("sensor", 2, None), ("flag", 2, 2)],
+    'measurements_cut_ws.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 50), ("sensor", 3, None),
+                                ("flag", 1, 2)],
+    'measurements_co2.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 10), ("sensor", 2, None),
+                             ("flag", 1, 2)],
+    'measurements_buoys_1.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 8), ("sensor", 5, None),
+                                 ("text", 1, 20)],
+    'measurements_buoys_2.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 2), ("sensor", 3, None)],
+    'microcontrollers_measurements.csv': [("id", 1, None), ("timestamp", 1, None), ("category", 1, 10),
+                                          ("sensor", 3, None), ("flag", 1, 2)],
+    'measurements.csv': MEASUREMENTS,
+}
+
+
+def column_mix(file_name):
+    return COLUMN_MIXES.get(file_name, MEASUREMENTS)
+
+
+def generate_frame(file_name, n_rows, seed=0):
+    """ Synthetic table with the column mix of file_name, the same for the same seed """
+    rng = np.random.default_rng(seed)
+    data = {}
+    for kind, count, distinct in column_mix(file_name):
+        for idx in range(count):
+            name = f"{kind}_{idx + 1}"
+            if kind == "id":
+                data[name] = np.arange(1, n_rows + 1)
+            elif kind == "timestamp":
+                steps = rng.choice([60, 60, 60, 120], n_rows)
+                data[name] = pd.to_datetime(1600000000 + np.cumsum(steps), unit="s").astype(str)
+            elif kind == "category":
+                # Zipf-like skew: a few stations produce most rows
+                weights = 1 / np.arange(1, distinct + 1)
+                stations = [f"S{value:04d}" for value in range(distinct)]
+                data[name] = rng.choice(stations, n_rows, p=weights / weights.sum())
+            elif kind == "sensor":
+                walk = np.cumsum(rng.normal(0, 0.1 * (idx + 1), n_rows)) + rng.uniform(-50, 50)
+                data[name] = np.round(walk, idx % 3 + 1)
+            elif kind == "flag":
+                data[name] = rng.integers(0, distinct, n_rows)
+            else:
+                words = [f"word{value}" for value in range(distinct)]
+                data[name] = [" ".join(pair) for pair in rng.choice(words, (n_rows, 2))]
+    return pd.DataFrame(data)
+
+
+def generate(file_name, out_dir, scale=DEFAULT_SCALE, seed=0):
+    """ Write the synthetic table of file_name with scale times its envmondb size, return its path """
+    size_mb = dict((name, size) for size, name in file_sizes)[file_name]
+    sample = generate_frame(file_name, 1000, seed)
+    row_bytes = len(compass_recording.serialize_partition(sample)) / len(sample)
+    n_rows = max(10, int(size_mb * 1024 ** 2 * scale / row_bytes))
+    path = os.path.join(out_dir, file_name)
+    generate_frame(file_name, n_rows, seed).to_csv(path, index=False)
+    return path
+
+
+def strategy_sizes(results_file):
+    """ Compressed bytes per strategy and codec of a results file """
+    sizes = defaultdict(int)
+    with open(results_file, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) >= 5 and row[4].isdigit():
+                sizes[f"{row[2]}{row[3]}"] += int(row[4])
+    return dict(sizes)
+
+
+def run_case(path, k_values, work_dir, repeat=1):
+    """ Run the sweep on one table, return the best per-stage metrics of repeat runs and the compressed sizes """
+    best = {}
+    sizes = {}
+    for run in range(repeat):
+        telemetry_file = os.path.join(work_dir, f"telemetry_{run}.jsonl")
+        results_file = os.path.join(work_dir, f"results_{run}.csv")
+        compass_telemetry.configure(telemetry_file)
+        with compass_recording.ResultRecorder() as recorder:
+            compass_main.run_sweep(path, os.path.join(work_dir, "entropy.csv"), results_file, k_values, recorder)
+        summary = compass_telemetry.summarize(compass_telemetry.read_records([telemetry_file]))
+        growth = defaultdict(int)
+        for record in compass_telemetry.read_records([telemetry_file]):
+            growth[record["stage"]] = max(growth[record["stage"]], record["rss_growth_kb"])
+        for stage, totals in summary.items():
+            metrics = {"wall_s": totals["wall_s"], "cpu_s": totals["cpu_s"], "rss_growth_kb": growth[stage]}
+            best[stage] = {key: min(value, best.get(stage, metrics)[key]) for key, value in metrics.items()}
+        sizes = strategy_sizes(results_file)
+    return {"stages": best, "sizes": sizes}
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Regressions of results against a baseline: slower stages and changed compressed sizes """
+    regressions = []
+    for table, result in results.items():
+        if table not in baseline:
+            continue
+        for stage, metrics in result["stages"].items():
+            before = baseline[table]["stages"].get(stage)
+            if before is None:
+                continue
+            for key in ("wall_s", "cpu_s"):
+                if metrics[key] > MIN_FLAGGED_SECONDS and metrics[key] > before[key] * (1 + tolerance):
+                    regressions.append(f"{table} {stage} {key}: {before[key]:.4f} -> {metrics[key]:.4f}")
+        for strategy, size in result["sizes"].items():
+            before = baseline[table]["sizes"].get(strategy)
+            if before is not None and before != size:
+                regressions.append(f"{table} {strategy} bytes: {before} -> {size}")
+    return regressions
+
+
+def main():
+    tables = {label: file_name for file_name, label in file_mapping.items()}
+    parser = argparse.ArgumentParser(description='Benchmark COMPASS on synthetic envmondb-shaped tables.')
+    parser.add_argument('--tables', nargs='+', choices=sorted(tables, key=lambda label: int(label[1:])),
+                        default=["T5", "T8", "T12", "T15"], help='Tables to generate and run')
+    parser.add_argument('--scale', type=float, default=DEFAULT_SCALE, help='Fraction of the envmondb table sizes')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the table generators')
+    parser.add_argument('--k-range', default='2:4', help='Cluster counts swept on every table')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per table, the fastest is kept')
+    parser.add_argument('--baseline', help='Baseline JSON to compare with, exits 1 on regressions')
+    parser.add_argument('--save-baseline', help='Write the results as a baseline JSON')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Allowed relative slowdown')
+    parser.add_argument('--keep-tables', help='Write the generated tables to this directory and keep them')
+    args = parser.parse_args()
+    try:
+        k_values = compass_main.parse_k_range(args.k_range)
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        table_dir = args.keep_tables or work_dir
+        os.makedirs(table_dir, exist_ok=True)
+        for label in args.tables:
+            path = generate(tables[label], table_dir, args.scale, args.seed)
+            print(f"{label}: {tables[label]}, {os.path.getsize(path)} bytes")
+            with tempfile.TemporaryDirectory(dir=work_dir) as case_dir:
+                results[label] = run_case(path, k_values, case_dir, args.repeat)
+
+    print("table,stage,wall_s,cpu_s,rss_growth_kb")
+    for label, result in results.items():
+        for stage, metrics in result["stages"].items():
+            print(f"{label},{stage},{metrics['wall_s']:.6f},{metrics['cpu_s']:.6f},{metrics['rss_growth_kb']}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"scale": args.scale, "seed": args.seed, "k_range": args.k_range, "tables": results}, f,
+                      indent=1)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline["scale"], baseline["seed"], baseline["k_range"]) != (args.scale, args.seed, args.k_range):
+            parser.error("the baseline was recorded with another --scale, --seed or --k-range")
+        regressions = compare(results, baseline["tables"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
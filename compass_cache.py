@@ -0,0 +1,182 @@
+"""
+compass_cache.py
+Purpose: Parse-once columnar cache for the COMPASS input tables.
+
+The first load of a CSV file (or directory of CSV files) parses it with pandas and stores every column as a .npy file
+in a cache entry keyed by the path, modification time and size of the input and the dtypes it is loaded with. Later
+loads memory-map the numeric columns and rebuild text columns from factorized or categorical codes instead of parsing
+the CSV again. Entries are evicted least recently used first once the cache grows past its size limit.
+
+Usage: compass_cache.py {list,invalidate,clear} [input_file.csv or directory] [--cache-dir DIR]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import compass_ingest
+
+DEFAULT_CACHE_DIR = os.environ.get("COMPASS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "compass"))
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+META_FILE = "meta.json"
+
+
+def source_files(in_file):
+    """ CSV files behind an input file or directory, in the order the loaders read them """
+    if os.path.isdir(in_file):
+        return compass_ingest.csv_files(in_file)
+    return [in_file]
+
+
+def cache_key(in_file):
+    """ Content address of an input: path, modification time and size of every CSV file, and its load dtypes """
+    digest = hashlib.sha1(b"compact\n" if compass_ingest.COMPACT else b"")
+    for file in source_files(in_file):
+        stat = os.stat(file)
+        digest.update(f"{os.path.abspath(file)}|{stat.st_mtime_ns}|{stat.st_size}\n".encode())
+    return digest.hexdigest()[:20]
+
+
+def read_csv(in_file):
+    """ Parse an input file or a directory of CSV files into one DataFrame """
+    return compass_ingest.read_table(in_file)
+
+
+def _entry_size(entry_dir):
+    return sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+
+
+def _write_entry(df_in, entry_dir, in_file):
+    """ Store every column of df_in as .npy files next to a meta.json describing them """
+    # Private temporary directory, several processes may load the same input at once
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir), prefix=os.path.basename(entry_dir) + ".tmp")
+    columns = []
+    for idx, col in enumerate(df_in.columns):
+        series = df_in[col]
+        if series.dtype.kind in "biuf":
+            np.save(os.path.join(tmp_dir, f"{idx}.npy"), series.to_numpy())
+            columns.append({"name": col, "kind": "numeric"})
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp_dir, f"{idx}.npy"), series.cat.codes.to_numpy())
+            np.save(os.path.join(tmp_dir, f"{idx}.values.npy"), np.asarray(series.cat.categories, dtype=object),
+                    allow_pickle=True)
+            columns.append({"name": col, "kind": "categorical"})
+        else:
+            codes, uniques = pd.factorize(series)
+            code_type = np.int32 if len(uniques) < 2 ** 31 else np.int64
+            np.save(os.path.join(tmp_dir, f"{idx}.npy"), codes.astype(code_type))
+            np.save(os.path.join(tmp_dir, f"{idx}.values.npy"), np.asarray(uniques, dtype=object), allow_pickle=True)
+            columns.append({"name": col, "kind": "factorized"})
+    with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+        json.dump({"source": os.path.abspath(in_file), "rows": len(df_in), "columns": columns}, f)
+    # Publish the entry in one rename so readers never see a partial entry
+    try:
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # Another process published the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _read_entry(entry_dir):
+    """ Rebuild the DataFrame of a cache entry, numeric columns stay memory-mapped """
+    with open(os.path.join(entry_dir, META_FILE)) as f:
+        meta = json.load(f)
+    data = {}
+    for idx, column in enumerate(meta["columns"]):
+        values = np.load(os.path.join(entry_dir, f"{idx}.npy"), mmap_mode="r")
+        if column["kind"] == "factorized":
+            uniques = np.load(os.path.join(entry_dir, f"{idx}.values.npy"), allow_pickle=True)
+            # Missing values have code -1
+            restored = np.empty(len(values), dtype=object)
+            present = values >= 0
+            restored[present] = uniques[values[present]]
+            restored[~present] = np.nan
+            values = restored
+        elif column["kind"] == "categorical":
+            categories = np.load(os.path.join(entry_dir, f"{idx}.values.npy"), allow_pickle=True)
+            values = pd.Categorical.from_codes(values, categories)
+        data[column["name"]] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def evict(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """ Remove least recently used entries until the cache is at most max_bytes """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+               if os.path.isfile(os.path.join(cache_dir, name, META_FILE))]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    total = 0
+    for entry_dir in entries:
+        total += _entry_size(entry_dir)
+        if total > max_bytes:
+            print(f"Evicting cache entry {entry_dir}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+def load(in_file, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """ Load an input through the cache, parsing the CSV only when there is no entry for its current content """
+    entry_dir = os.path.join(cache_dir, cache_key(in_file))
+    if os.path.isfile(os.path.join(entry_dir, META_FILE)):
+        print(f"Loading {in_file} from cache {entry_dir}")
+        # The directory modification time records the last use for eviction
+        os.utime(entry_dir)
+        return _read_entry(entry_dir)
+
+    df_in = read_csv(in_file)
+    if len(df_in.columns) > 0:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_entry(df_in, entry_dir, in_file)
+        evict(cache_dir, max_bytes)
+    return df_in
+
+
+def invalidate(in_file, cache_dir=DEFAULT_CACHE_DIR):
+    """ Remove every cache entry created from in_file, whatever its modification time was """
+    source = os.path.abspath(in_file)
+    for name, meta in entries(cache_dir):
+        if meta["source"] == source:
+            print(f"Removing cache entry {name} for {source}")
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+def entries(cache_dir=DEFAULT_CACHE_DIR):
+    """ List (entry name, meta data) of the cache """
+    if not os.path.isdir(cache_dir):
+        return []
+    found = []
+    for name in sorted(os.listdir(cache_dir)):
+        meta_file = os.path.join(cache_dir, name, META_FILE)
+        if os.path.isfile(meta_file):
+            with open(meta_file) as f:
+                found.append((name, json.load(f)))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the COMPASS columnar cache.')
+    parser.add_argument('command', choices=['list', 'invalidate', 'clear'])
+    parser.add_argument('input_file', nargs='?', help='Input CSV file or directory to invalidate')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Cache directory')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for name, meta in entries(args.cache_dir):
+            size = _entry_size(os.path.join(args.cache_dir, name))
+            print(f"{name},{meta['source']},{meta['rows']},rows,{size},bytes")
+    elif args.command == 'invalidate':
+        if not args.input_file:
+            parser.error("invalidate needs an input file or directory")
+        invalidate(args.input_file, args.cache_dir)
+    else:
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,167 @@
 import csv
-from collections import defaultdict
 import argparse
+import os
 import sys
 
+import numpy as np
+import pandas as pd
+
+import compass_profile
+
+# Column of the results minimized when choosing a codec
+OBJECTIVES = {
+    "size": "size",
+    "compress": "compress_time",
+    "decompress": "decompress_time",
+}
+# Fields of a results row: cluster,name,method,compression,size,bytes,compress s,s,decompress s,s[,jobs,jobs]
+RESULT_FIELDS = 12
+
+
+def to_seconds(values):
+    """ Seconds of a results column, infinite where missing or not a number """
+    return pd.to_numeric(values, errors="coerce").fillna(np.inf)
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Aggregate data from input files.')
     parser.add_argument('input_files', nargs='+', help='Input CSV files')
     parser.add_argument('--output_file', '-o', default='aggregated_data.csv', help='Output CSV file')
     parser.add_argument('--verbose', '-v', action='store_true', help='Print verbose output')
+    parser.add_argument('--objective', choices=list(OBJECTIVES), default='size',
+                        help='Pick the codec of each cluster with the smallest size, compression or decompression time')
+    parser.add_argument('--compressibility-profile', metavar='FILE', dest='profile',
+                        help='Compressibility profile of the table, to add estimated rows for its layouts')
+    parser.add_argument('--thresholds', nargs='*', type=float,
+                        help='SIBACO entropy thresholds to estimate with the profile, every distinct split if empty')
+    parser.add_argument('--confirm', type=int, default=0, metavar='N',
+                        help='Compress the N best estimated layouts that have no results yet and aggregate them too')
+    parser.add_argument('--confirm-file', default='confirmed_results.csv',
+                        help='Results file where the confirmed layouts are appended')
     return parser.parse_args()
 
 
-def aggregate_data(input_files, output_file, verbose=False):
-    # Initialize data structures
-    data = defaultdict(lambda: {"size": 0, "num_clusters": "Unknown"})
-    baseline_data = defaultdict(int)
-    method_compression_size = defaultdict(list)
-
-    # Parse input data from each file
-    for input_file in input_files:
-        with open(input_file, newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            next(reader)  # Skip the header row
-            for row in reader:
-                row = [item.strip() for item in row]  # Strip whitespace from each item
-                if len(row) < 6:
-                    if verbose:
-                        print(f"Ignoring invalid row: {row}")
-                    continue
-                cluster, file_name, method, compression, size, _, _, _, _, _ = row
-                size = int(size) if size.isdigit() else 0
-                if "full" in file_name:
-                    baseline_data[method + "_" + compression] += size
-                else:
-                    method_parts = method.split(" (")
-                    num_clusters = method_parts[1].replace(')', '') if len(method_parts) > 1 else "2"
-                    data[method + "_" + compression]["size"] += size
-                    data[method + "_" + compression]["num_clusters"] = num_clusters
-                    method_compression_size[method].append((cluster, size, compression))
+def read_results(input_file, verbose=False):
+    """ Typed rows of one results file; a header row, if any, and rows with fewer than six fields are dropped """
+    raw = pd.read_csv(input_file, header=None, names=range(RESULT_FIELDS), dtype=str, keep_default_na=False,
+                      on_bad_lines="skip", skip_blank_lines=True)
+    raw = raw.apply(lambda column: column.str.strip())
+    if len(raw) > 0 and not raw.iloc[0, 4].isdigit():
+        raw = raw.iloc[1:]
+    invalid = raw[5] == ""
+    if verbose:
+        for row in raw[invalid].itertuples(index=False):
+            print(f"Ignoring invalid row: {[item for item in row if item]}")
+    raw = raw[~invalid]
+    size = raw[4].where(raw[4].str.isdigit(), "0")
+    return pd.DataFrame({
+        "cluster": raw[0],
+        "file_name": raw[1],
+        "method": raw[2],
+        "compression": raw[3],
+        "size": size.astype(np.int64),
+        "compress_time": to_seconds(raw[6]),
+        "decompress_time": to_seconds(raw[8]),
+    })
+
+
+def load_results(input_files, verbose=False):
+    """ All results rows of the input files in one DataFrame, flagging the full-table baseline rows """
+    results = pd.concat([read_results(input_file, verbose) for input_file in input_files], ignore_index=True)
+    # split_columns records the whole table as cluster 0 named <table>_full.csv
+    results["baseline"] = results["file_name"].str.endswith("_full.csv")
+    results["method_compression"] = results["method"] + "_" + results["compression"]
+    return results
+
+
+def throughput(size, seconds):
+    """ Compressed megabytes decoded per second, 0 when the time is unknown """
+    return float(size / seconds / 1e6) if 0 < seconds < np.inf else 0
+
+
+def candidate_layouts(profile, thresholds=None):
+    """ Layouts saved in a profile and the SIBACO layouts of thresholds, leaving out layouts listed twice """
+    layouts = dict(profile["layouts"])
+    if thresholds is not None:
+        for threshold in thresholds or compass_profile.threshold_candidates(profile["entropies"]):
+            layouts[f"SIBACO_T{threshold:g}"] = compass_profile.sibaco_layout(profile, threshold)
+    distinct = {}
+    seen = set()
+    for label, groups in layouts.items():
+        key = frozenset(frozenset(group) for group in groups if group)
+        if key not in seen:
+            seen.add(key)
+            distinct[label] = groups
+    return distinct
+
+
+def estimate_rows(profile, layouts, objective='size'):
+    """ Aggregated rows of layouts estimated from a profile, best first, against the estimated baseline """
+    choose = OBJECTIVES[objective]
+    baseline, _ = compass_profile.estimate_baseline(profile, choose)
+    rows = []
+    for label, totals, codecs in compass_profile.rank(profile, layouts, choose):
+        rows.append([f"ESTIMATED_{label}", len(codecs), int(totals["size"]),
+                     (baseline["size"] - totals["size"]) / baseline["size"],
+                     ";".join(f"{idx + 1}:{codec}" for idx, codec in enumerate(codecs)), totals["decompress_time"],
+                     throughput(totals["size"], totals["decompress_time"])])
+    return rows
+
+
+def aggregate_data(input_files, output_file, verbose=False, objective='size', estimated=None):
+    results = load_results(input_files, verbose)
+    choose = OBJECTIVES[objective]
+    baseline_rows = results[results["baseline"]]
+    cluster_rows = results[~results["baseline"]]
+    if len(baseline_rows) == 0:
+        print(f"Error: no _full.csv baseline rows in {', '.join(input_files)}")
+        sys.exit(1)
+
+    # Totals per method and codec, in order of appearance
+    totals = ["size", "compress_time", "decompress_time"]
+    baseline = baseline_rows.groupby("method_compression", sort=False)[totals].sum()
+    # Number of clusters from the cluster id field of the rows, not from the method label
+    data = cluster_rows.groupby("method_compression", sort=False).agg(
+        size=("size", "sum"), num_clusters=("cluster", "nunique"))
+
+    # Best codec of each cluster under the objective, first one on ties
+    best = cluster_rows.loc[cluster_rows.groupby(["method", "cluster"], sort=False)[choose].idxmin()]
+    best = best.assign(codec=best["cluster"] + ":" + best["compression"])
+    methods = best.groupby("method", sort=False).agg(
+        clusters=("cluster", "size"), size=("size", "sum"), decompress_time=("decompress_time", "sum"),
+        codecs=("codec", ";".join))
 
     # Write aggregated data to the output file
     with open(output_file, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(['Method-Compression', 'Number of Clusters', 'Sum of Size (bytes)', 'Performance'])
+        writer.writerow(['Method-Compression', 'Number of Clusters', 'Sum of Size (bytes)', 'Performance', 'Codecs',
+                         'Decompress Seconds', 'Decompress Throughput (compressed MB/s)'])
 
         if verbose:
             # Write aggregated data
-            for method_compression, values in data.items():
-                writer.writerow([method_compression, values["num_clusters"], values["size"], 0])
+            for method_compression, values in data.iterrows():
+                writer.writerow([method_compression, values["num_clusters"], int(values["size"]), 0])
 
             # Write baseline data
-            for method_compression, size in baseline_data.items():
-                writer.writerow(["BASELINE_" + method_compression, 1, size])
+            for method_compression, values in baseline.iterrows():
+                writer.writerow(["BASELINE_" + method_compression, 1, int(values["size"])])
             writer.writerow("-----")
-        min_baseline = min(baseline_data.values())
-        writer.writerow(["COMPASS_BASELINE", 1, min_baseline, 0])
-        # Calculate and write COMPASS row for each method
-        for method, cluster_sizes in method_compression_size.items():
-            cluster_dict = defaultdict(list)
-
-            # Store sizes in the dictionary based on clusters
-            for cluster, size, _ in cluster_sizes:
-                cluster_dict[cluster].append(size)
-
-            # Find the minimum size for each cluster and sum them up
-            total_min_size = sum(min(sizes, default=0) for sizes in cluster_dict.values())
+        # The baseline is the full table with the best codec under the objective
+        baseline_codec = baseline[choose].idxmin()
+        min_baseline = int(baseline.loc[baseline_codec, "size"])
+        baseline_seconds = float(baseline.loc[baseline_codec, "decompress_time"])
+        writer.writerow(["COMPASS_BASELINE", 1, min_baseline, 0, baseline_codec, baseline_seconds,
+                         throughput(min_baseline, baseline_seconds)])
+        # Write the COMPASS row of each method
+        for method, values in methods.iterrows():
+            total_min_size = int(values["size"])
             writer.writerow(
-                [f"COMPASS_{method}", len(cluster_dict), total_min_size,
-                 ((min_baseline - total_min_size) / min_baseline)])
+                [f"COMPASS_{method}", int(values["clusters"]), total_min_size,
+                 ((min_baseline - total_min_size) / min_baseline), values["codecs"],
+                 float(values["decompress_time"]), throughput(total_min_size, values["decompress_time"])])
+        # Layouts estimated from a compressibility profile, not compressed
+        for row in estimated or []:
+            writer.writerow(row)
 
     print(f"Aggregated data CSV file '{output_file}' created successfully.")
 
@@ -81,7 +174,26 @@ def main():
         print("At least one input file must be provided.")
         sys.exit(1)
 
-    aggregate_data(args.input_files, args.output_file, args.verbose)
+    estimated = None
+    input_files = list(args.input_files)
+    if args.profile:
+        profile = compass_profile.load(args.profile)
+        layouts = candidate_layouts(profile, args.thresholds)
+        if os.path.isfile(args.confirm_file):
+            input_files.append(args.confirm_file)
+        if args.confirm:
+            # Layouts already in the results do not need to be compressed again
+            measured = set(load_results(input_files)["method"].str.replace("ENCODED_", "", regex=False))
+            ranked = compass_profile.rank(profile, layouts, OBJECTIVES[args.objective])
+            chosen = [label for label, _, _ in ranked if label not in measured][:args.confirm]
+            if chosen:
+                print(f"Confirming {', '.join(chosen)} in {args.confirm_file}")
+                compass_profile.confirm(profile, {label: layouts[label] for label in chosen}, args.confirm_file)
+            if chosen and args.confirm_file not in input_files:
+                input_files.append(args.confirm_file)
+        estimated = estimate_rows(profile, layouts, args.objective)
+
+    aggregate_data(input_files, args.output_file, args.verbose, args.objective, estimated)
 
 
 if __name__ == "__main__":
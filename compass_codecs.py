@@ -0,0 +1,122 @@
+"""
+compass_codecs.py
+Purpose: Registry of the compression codecs COMPASS can measure.
+
+Every codec has a name, a compress(data, level) and a decompress(data) function, the range of levels it accepts and
+its default level. The stdlib codecs (gzip/DEFLATE, bzip2, lzma) are always available; zstd, lz4, brotli and snappy
+are registered when their Python packages (zstandard, lz4, brotli, python-snappy) are installed.
+
+A codec is selected as a spec "name" or "name:level" or "name:first-last" for a range of levels. Results rows name the
+codec as ".name" at its default level and ".name-level" otherwise, with ".zip" appended in zip container mode.
+"""
+
+import bz2
+import lzma
+import zipfile
+import zlib
+from collections import namedtuple
+
+Codec = namedtuple("Codec", ["name", "compress", "decompress", "levels", "default_level", "zip_type"])
+
+CODECS = {}
+
+DEFAULT_SPECS = ["gzip", "bzip2", "lzma"]
+
+
+def register(codec):
+    """ Add a codec to the registry, replacing one of the same name """
+    CODECS[codec.name] = codec
+
+
+def _deflate(data, level):
+    # Raw DEFLATE stream, without the zip container
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _inflate(data):
+    return zlib.decompress(data, -15)
+
+
+register(Codec("gzip", _deflate, _inflate, range(0, 10), 6, zipfile.ZIP_DEFLATED))
+register(Codec("bzip2", lambda data, level: bz2.compress(data, level), bz2.decompress, range(1, 10), 9,
+               zipfile.ZIP_BZIP2))
+register(Codec("lzma", lambda data, level: lzma.compress(data, format=lzma.FORMAT_ALONE, preset=level),
+               lzma.decompress, range(0, 10), 6, zipfile.ZIP_LZMA))
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+if zstandard is not None:
+    register(Codec("zstd", lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+                   lambda data: zstandard.ZstdDecompressor().decompress(data), range(1, 23), 3, None))
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+if lz4 is not None:
+    register(Codec("lz4", lambda data, level: lz4.frame.compress(data, compression_level=level),
+                   lz4.frame.decompress, range(0, 17), 0, None))
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+if brotli is not None:
+    register(Codec("brotli", lambda data, level: brotli.compress(data, quality=level), brotli.decompress,
+                   range(0, 12), 11, None))
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+if snappy is not None:
+    register(Codec("snappy", lambda data, level: snappy.compress(data), snappy.decompress, range(0, 1), 0, None))
+
+# zipfile compression types of the stdlib codecs
+ZIP_CODECS = {codec.zip_type: codec.name for codec in CODECS.values() if codec.zip_type is not None}
+
+
+def parse_spec(spec):
+    """ Turn 'name', 'name:level' or 'name:first-last' into a list of (name, level) """
+    name, _, levels = spec.partition(":")
+    if name not in CODECS:
+        raise ValueError(f"unknown or unavailable codec '{name}', available: {', '.join(CODECS)}")
+    codec = CODECS[name]
+    if not levels:
+        return [(name, codec.default_level)]
+    first, _, last = levels.partition("-")
+    try:
+        selected = range(int(first), int(last or first) + 1)
+    except ValueError:
+        raise ValueError(f"{spec}: levels must be 'level' or 'first-last'") from None
+    if not selected:
+        raise ValueError(f"{spec}: the level range {levels} is empty")
+    invalid = [level for level in selected if level not in codec.levels]
+    if invalid:
+        raise ValueError(f"{name} levels are {codec.levels.start}-{codec.levels.stop - 1}, not {invalid}")
+    return [(name, level) for level in selected]
+
+
+def parse_specs(specs):
+    """ Parse a list of codec specs, keeping their order """
+    return [codec_level for spec in specs for codec_level in parse_spec(spec)]
+
+
+def label(codec_level, zip_container=False):
+    """ Compression label written in results rows """
+    name, level = codec_level
+    text = f".{name}" if level == CODECS[name].default_level else f".{name}-{level}"
+    return text + ".zip" if zip_container else text
+
+
+def parse_label(text):
+    """ Turn a results compression label back into (name, level, zip container) """
+    zip_container = text.endswith(".zip")
+    text = text[:-len(".zip")] if zip_container else text
+    name, _, level = text.lstrip(".").partition("-")
+    if level:
+        return name, int(level), zip_container
+    return name, CODECS[name].default_level if name in CODECS else None, zip_container
@@ -0,0 +1,214 @@
+"""
+compass_encoding.py
+Purpose: Reversible column pre-encoding of CSV partitions before they reach a general-purpose codec.
+
+Every column of a partition is encoded on its own, straight from the DataFrame column the recorder serializes:
+- rle: (value, run length) pairs, for columns made of long runs such as sorted keys
+- delta: first value and successive differences, for monotonic integers and "%Y-%m-%d %H:%M:%S" timestamps
+- dict: integer codes into a dictionary, for low-entropy or low-cardinality columns
+- plain: the fields unchanged
+The choice uses the runs and cardinality of pandas.factorize codes and the column entropy (from the entropy file
+when given, else from the codes). The encoded partition is a marker line, a JSON line describing the columns and one
+block per column. Decoding rewrites the CSV exactly, and encode_partition checks the round trip before returning,
+falling back to plain blocks for every column if it does not match.
+"""
+
+import csv
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+import compass_entropy
+
+MARKER = b"#COMPASS-ENCODED 1\n"
+PLAIN = "plain"
+DICT = "dict"
+DELTA = "delta"
+RLE = "rle"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Columns with at most rows / RLE_MIN_RUN runs are run-length encoded
+RLE_MIN_RUN = 4
+DICT_MAX_VALUES = 65536
+
+
+def _write_csv(rows):
+    # pandas.to_csv writes through csv.writer with these settings
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue()
+
+
+def _read_csv(text):
+    return list(csv.reader(io.StringIO(text)))
+
+
+def _to_csv(frame):
+    """ CSV text of frame without header, formatted as serialize_partition formats its columns """
+    return frame.to_csv(index=False, header=False)
+
+
+def _fields(text):
+    """ Field strings of the CSV text of a single column """
+    return [row[0] if row else "" for row in _read_csv(text)]
+
+
+def _integers(col):
+    """ Integers of a column and how to print them back, or None if they are not monotonic canonical integers """
+    if len(col) == 0 or col.hasnans:
+        return None
+    if pd.api.types.is_integer_dtype(col):
+        values = col.to_numpy(dtype=np.int64)
+        time_format = None
+    elif pd.api.types.is_object_dtype(col) or pd.api.types.is_string_dtype(col):
+        text = col.astype(str)
+        numbers = pd.to_numeric(text, errors="coerce")
+        times = pd.to_datetime(text, format=TIMESTAMP_FORMAT, errors="coerce")
+        if numbers.notna().all() and (numbers % 1 == 0).all() and (numbers.astype("int64").astype(str) == text).all():
+            values = numbers.to_numpy(dtype=np.int64)
+            time_format = None
+        elif times.notna().all() and (times.dt.strftime(TIMESTAMP_FORMAT) == text).all():
+            values = ((times - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
+            time_format = TIMESTAMP_FORMAT
+        else:
+            return None
+    else:
+        return None
+    if (np.diff(values) < 0).any():
+        return None
+    return values, time_format
+
+
+def _factorize(col):
+    """
+    Codes of the values of a column, numbered in order of first appearance, and the first row of every code
+    Floats are compared by their bits, since 0.0 and -0.0 are equal but are written differently.
+    """
+    values = col
+    if isinstance(col.dtype, np.dtype) and col.dtype.kind == "f":
+        values = col.to_numpy().view(f"i{col.dtype.itemsize}")
+    codes, _ = pd.factorize(values, use_na_sentinel=False)
+    return codes, np.unique(codes, return_index=True)[1]
+
+
+def _entropy(codes):
+    probabilities = np.bincount(codes) / len(codes)
+    return float(-(probabilities * np.log(probabilities)).sum())
+
+
+def choose_encoding(col, entropy=None, threshold=compass_entropy.SIBACO_THRESHOLD):
+    """
+    Encoding of a column from the runs and cardinality of its factorized codes, its monotonicity and its entropy
+    threshold : columns of lower entropy are dictionary encoded, the SIBACO threshold of the run
+    return : (encoding, integers of a delta encoding or the codes and first rows of _factorize)
+    """
+    if len(col) == 0:
+        return PLAIN, None
+    codes, first = _factorize(col)
+    runs = 1 + np.count_nonzero(codes[1:] != codes[:-1])
+    if runs <= len(col) / RLE_MIN_RUN:
+        return RLE, (codes, first)
+    integers = _integers(col)
+    if integers is not None:
+        return DELTA, integers
+    if entropy is None:
+        entropy = _entropy(codes)
+    if len(first) <= DICT_MAX_VALUES and (entropy < threshold or len(first) <= len(col) / 2):
+        return DICT, (codes, first)
+    return PLAIN, None
+
+
+def encode_column(col, encoding, state=None):
+    """ (column description, block text) of one column, state being what choose_encoding returned with encoding """
+    if encoding == RLE:
+        codes, _ = state
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        lengths = np.diff(np.r_[starts, len(codes)])
+        runs = pd.DataFrame({"value": col.iloc[starts].reset_index(drop=True), "count": lengths})
+        return {"encoding": RLE}, _to_csv(runs)
+    if encoding == DELTA:
+        values, time_format = state
+        deltas = np.diff(values, prepend=0)
+        return {"encoding": DELTA, "format": time_format}, _to_csv(pd.Series(deltas))
+    if encoding == DICT:
+        codes, first = state
+        dictionary = _fields(_to_csv(col.iloc[first].to_frame()))
+        return {"encoding": DICT, "dictionary": dictionary}, _to_csv(pd.Series(codes))
+    return {"encoding": PLAIN}, _to_csv(col.to_frame())
+
+
+def decode_column(description, block, rows):
+    """ Field strings of one encoded column """
+    encoding = description["encoding"]
+    if encoding == RLE:
+        runs = _read_csv(block)
+        values = np.array([value for value, _ in runs], dtype=object)
+        return np.repeat(values, [int(count) for _, count in runs]).tolist()
+    if encoding == DELTA:
+        values = pd.Series(np.array(block.split(), dtype=np.int64)).cumsum()
+        if description["format"]:
+            return pd.to_datetime(values, unit="s").dt.strftime(description["format"]).tolist()
+        return values.astype(str).tolist()
+    if encoding == DICT:
+        dictionary = np.array(description["dictionary"], dtype=object)
+        return dictionary[np.array(block.split(), dtype=np.int64)].tolist()
+    return _fields(block)[:rows]
+
+
+def encode(df, columns=None, entropies=None, threshold=compass_entropy.SIBACO_THRESHOLD, plain=False):
+    """
+    Encoded bytes of a column projection of df and the encoding of every column
+    plain : write every column as a plain block
+    """
+    frame = df if columns is None else df[columns]
+    entropies = entropies or {}
+    descriptions = []
+    blocks = []
+    for name in frame.columns:
+        col = frame[name]
+        encoding, state = (PLAIN, None) if plain else choose_encoding(col, entropies.get(name), threshold)
+        description, block = encode_column(col, encoding, state)
+        block = block.encode()
+        description.update(name=name, bytes=len(block))
+        descriptions.append(description)
+        blocks.append(block)
+    meta = json.dumps({"rows": len(frame), "columns": descriptions}).encode() + b"\n"
+    return MARKER + meta + b"".join(blocks), {d["name"]: d["encoding"] for d in descriptions}
+
+
+def decode(encoded):
+    """ CSV partition bytes of an encoded partition """
+    meta_end = encoded.index(b"\n", len(MARKER))
+    meta = json.loads(encoded[len(MARKER):meta_end])
+    if not meta["columns"]:
+        # pandas writes an empty header line and an empty line per row
+        return b"\n" * (meta["rows"] + 1)
+    position = meta_end + 1
+    columns = []
+    for description in meta["columns"]:
+        block = encoded[position:position + description["bytes"]].decode()
+        position += description["bytes"]
+        columns.append(decode_column(description, block, meta["rows"]))
+    header = [description["name"] for description in meta["columns"]]
+    return _write_csv([header] + [list(row) for row in zip(*columns)]).encode()
+
+
+def encode_partition(df, columns, data, entropies=None, threshold=compass_entropy.SIBACO_THRESHOLD):
+    """
+    Encode a column projection of df, verifying that it decodes back to data, its serialized CSV bytes
+    A partition whose encoding does not round trip is encoded with plain blocks, so every partition of a run has
+    the same format; ValueError is raised if even those do not decode back to data.
+    return : (bytes to compress, encoding of every column)
+    """
+    try:
+        encoded, encodings = encode(df, columns, entropies, threshold)
+        if decode(encoded) == data:
+            return encoded, encodings
+        print(" *** Encoded partition does not round trip, writing plain blocks")
+    except (ValueError, IndexError, UnicodeDecodeError) as e:
+        print(f" *** Encoding failed, writing plain blocks: {e!r}")
+    encoded, encodings = encode(df, columns, plain=True)
+    if decode(encoded) != data:
+        raise ValueError("plain blocks of the partition do not decode back to its CSV bytes")
+    return encoded, encodings
@@ -1,9 +1,39 @@
 import os
 import csv
-import glob
+import hashlib
+import io
+import pickle
+import subprocess
 import pandas as pd
 
-from scipy.stats import entropy
+import compass_ingest
+import compass_sketch
+import compass_telemetry
+
+# Columns with more distinct values than this are sketched in approximate mode
+EXACT_LIMIT = 100000
+# Rows per chunk when approximate mode is used without an explicit chunk size
+DEFAULT_CHUNKSIZE = 100000
+# Entropy backends
+PANDAS = "pandas"
+NATIVE = "native"
+# Compiled entropy_calculator.cpp, see README.md
+NATIVE_EXECUTABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "entropy_calculator")
+# Sketched entropies this close to the threshold (in standard errors) are recounted exactly
+RECOUNT_MARGIN = 3
+# Default SIBACO threshold, see compass_main.SIBACO_THRESHOLD
+SIBACO_THRESHOLD = 3
+# Bytes at the start of a source file whose hash detects rewrites in incremental mode
+HEAD_BYTES = 65536
+# Chunks are counted as text: pandas infers the dtypes of every chunk separately, so the same field could be counted
+# as 1 in one chunk and '1' in another. typed_counts then gives the merged counts the dtype of the whole column.
+CHUNK_DTYPE = str
+
+
+def entropy(counts):
+    """ Shannon entropy (nats) of value counts, with scipy imported on first use """
+    from scipy.stats import entropy as scipy_entropy
+    return scipy_entropy(counts)
 
 
 def shannon_entropy(col):
@@ -12,26 +42,273 @@ def shannon_entropy(col):
     return entropy_value
 
 
-def analyze(input_file, outfpath):
-    """ Analyse input file, write output file """
-    df = []
-    if os.path.isdir(input_file):
-        # Get CSV files list from a folder
-        csv_files = glob.glob(input_file + "/*.csv")
-
-        # Read each CSV file into DataFrame
-        # This creates a list of dataframes
-        df_list = (pd.read_csv(file) for file in csv_files)
-
-        # Concatenate all DataFrames
-        df = pd.concat(df_list, ignore_index=True)
-    if os.path.isfile(input_file):
-        df = pd.read_csv(input_file, sep=',', header=0)
-
-    entropies = {col: shannon_entropy(df[col]) for col in df}
-    # Write output
+def write_entropies(entropies, outfpath):
+    """ Write the column names and their entropies as a header row and a values row """
     with open(outfpath, 'w') as ouf:
         csvwriter = csv.writer(ouf, lineterminator='\n')
         entropy_row = [entropies[colix] for colix in entropies.keys()]
         csvwriter.writerow(entropies)
         csvwriter.writerow(entropy_row)
+
+
+def read_entropies(outfpath):
+    """ Column entropies of an entropy file """
+    return pd.read_csv(outfpath).iloc[0].to_dict()
+
+
+def read_chunks(input_file, chunksize, usecols=None):
+    """
+    Yield DataFrames of at most chunksize rows from a CSV file or a directory of CSV files, whose chunks are aligned
+    on the columns of all its files
+    """
+    if os.path.isdir(input_file):
+        yield from compass_ingest.iter_directory(input_file, chunksize, usecols, CHUNK_DTYPE)
+    elif os.path.isfile(input_file):
+        with pd.read_csv(input_file, sep=',', header=0, chunksize=chunksize, usecols=usecols,
+                         dtype=CHUNK_DTYPE) as reader:
+            yield from reader
+
+
+def merge_counts(counts, chunk):
+    """ Add the value counts of every column of chunk to counts """
+    for col in chunk:
+        chunk_counts = chunk[col].value_counts()
+        if col in counts:
+            counts[col] = counts[col].add(chunk_counts, fill_value=0)
+        else:
+            counts[col] = chunk_counts
+
+
+def typed_counts(col_counts):
+    """
+    Counts of the text values of a column merged by the values pandas parses them to when it reads the whole column,
+    so that, as in a whole-table read, '1' and '1.0' are one value in a numeric column and two in a text column
+    """
+    if len(col_counts) == 0:
+        return col_counts
+    text = pd.Series(col_counts.index.astype(str)).to_csv(index=False, header=["value"])
+    values = pd.read_csv(io.StringIO(text), sep=',', header=0)["value"]
+    return col_counts.groupby(values.to_numpy(), dropna=False).sum()
+
+
+def count_values(input_file, chunksize, columns=None):
+    """ Merge the value counts of every column (or only the given columns) chunk by chunk """
+    usecols = None if columns is None else (lambda col: col in columns)
+    counts = {}
+    for chunk in read_chunks(input_file, chunksize, usecols):
+        merge_counts(counts, chunk)
+    return counts
+
+
+def analyze_chunks(input_file, outfpath, chunksize):
+    """ Analyse input file in chunks of chunksize rows, write output file """
+    counts = count_values(input_file, chunksize)
+    entropies = {col: entropy(typed_counts(col_counts)) for col, col_counts in counts.items()}
+    write_entropies(entropies, outfpath)
+
+
+def state_file(outfpath):
+    """ Frequency state persisted next to the entropy file """
+    return outfpath + ".state"
+
+
+def load_state(outfpath):
+    if not os.path.isfile(state_file(outfpath)):
+        return None
+    with open(state_file(outfpath), "rb") as f:
+        return pickle.load(f)
+
+
+def save_state(outfpath, state):
+    tmp_file = state_file(outfpath) + ".tmp"
+    with open(tmp_file, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(tmp_file, state_file(outfpath))
+
+
+def _head_hash(file, length):
+    with open(file, "rb") as f:
+        return hashlib.sha1(f.read(min(length, HEAD_BYTES))).hexdigest()
+
+
+def _complete_rows_end(file):
+    """ Offset just after the last line break, so a row still being appended is left for the next run """
+    size = os.path.getsize(file)
+    with open(file, "rb") as f:
+        f.seek(max(0, size - 1))
+        if f.read(1) in (b"\n", b""):
+            return size
+        position = size
+        while position > 0:
+            step = min(position, 65536)
+            f.seek(position - step)
+            block = f.read(step)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                return position - step + newline + 1
+            position -= step
+    return 0
+
+
+def _is_appended(source, file):
+    """ True if file only grew since the state recorded source """
+    return (os.path.getsize(file) >= source["offset"]
+            and _head_hash(file, source["offset"]) == source["head_hash"])
+
+
+def _read_new_rows(file, source, chunksize):
+    """ Yield the rows of file between the recorded offset and the last complete row """
+    end = _complete_rows_end(file)
+    if end <= source["offset"]:
+        return
+    with open(file, "rb") as f:
+        f.seek(source["offset"])
+        data = f.read(end - source["offset"])
+    if source["offset"] == 0:
+        source["columns"] = pd.read_csv(io.BytesIO(data), sep=',', header=0, nrows=0).columns.tolist()
+        reader = pd.read_csv(io.BytesIO(data), sep=',', header=0, chunksize=chunksize, dtype=CHUNK_DTYPE)
+    else:
+        reader = pd.read_csv(io.BytesIO(data), sep=',', header=None, names=source["columns"], chunksize=chunksize,
+                             dtype=CHUNK_DTYPE)
+    with reader:
+        for chunk in reader:
+            yield chunk
+    source["offset"] = end
+    source["head_hash"] = _head_hash(file, end)
+
+
+def analyze_incremental(input_file, outfpath, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Analyse only the rows and files appended since the last run, write output file
+    The per-column value counts and the read position of every source file are kept in state_file(outfpath).
+    A source file that was rewritten, shrunk or removed makes the state start over from an empty count.
+    return : the updated state, including a 'grouping' entry that callers may use and save back
+    """
+    with compass_telemetry.stage("entropy", table=input_file, mode="incremental"):
+        return _analyze_incremental(input_file, outfpath, chunksize)
+
+
+def _analyze_incremental(input_file, outfpath, chunksize):
+    files = [os.path.abspath(file) for file in (compass_ingest.csv_files(input_file) if os.path.isdir(input_file)
+                                                 else [input_file])]
+    state = load_state(outfpath)
+    if state is not None:
+        sources = state["sources"]
+        if any(file not in files or not _is_appended(sources[file], file) for file in sources):
+            print(f"Sources of {outfpath} changed, recomputing the entropy from scratch")
+            state = None
+    if state is None:
+        state = {"sources": {}, "counts": {}, "grouping": None}
+
+    for file in files:
+        source = state["sources"].setdefault(file, {"offset": 0, "head_hash": "", "columns": []})
+        before = source["offset"]
+        for chunk in _read_new_rows(file, source, chunksize):
+            merge_counts(state["counts"], chunk)
+        print(f"Read {source['offset'] - before} new bytes of {file}")
+
+    entropies = {col: entropy(typed_counts(col_counts)) for col, col_counts in state["counts"].items()}
+    write_entropies(entropies, outfpath)
+    state["entropies"] = entropies
+    save_state(outfpath, state)
+    return state
+
+
+def entropy_drift(before, after):
+    """ Largest change of a column entropy, infinite when the columns differ """
+    if before is None or list(before) != list(after):
+        return float("inf")
+    return max((abs(after[col] - before[col]) for col in after), default=0.0)
+
+
+def sketch_values(input_file, chunksize, epsilon, exact_limit=EXACT_LIMIT):
+    """
+    Count values exactly until a column has more than exact_limit distinct values, then move it to a sketch
+    return : (columns in input order, exact counts per column, sketches per column)
+    """
+    columns = []
+    counts = {}
+    sketches = {}
+    for chunk in read_chunks(input_file, chunksize):
+        for col in chunk:
+            chunk_counts = chunk[col].value_counts()
+            if col in sketches:
+                sketches[col].update(chunk_counts)
+                continue
+            if col in counts:
+                chunk_counts = counts[col].add(chunk_counts, fill_value=0)
+            else:
+                columns.append(col)
+            if len(chunk_counts) > exact_limit:
+                counts.pop(col, None)
+                sketches[col] = compass_sketch.EntropySketch(epsilon)
+                sketches[col].update(chunk_counts)
+            else:
+                counts[col] = chunk_counts
+    return columns, counts, sketches
+
+
+def analyze_approximate(input_file, outfpath, chunksize, epsilon, exact_limit=EXACT_LIMIT, threshold=SIBACO_THRESHOLD):
+    """
+    Analyse input file with exact counts for columns up to exact_limit distinct values and sketches above it,
+    write output file. Sketched columns whose estimate could fall on either side of threshold are recounted exactly
+    in a second pass, so the selection get_entorpy_columns(en_file, threshold) matches the exact one.
+    """
+    columns, counts, sketches = sketch_values(input_file, chunksize, epsilon, exact_limit)
+
+    near_threshold = [col for col, sketch in sketches.items()
+                      if abs(sketch.estimate() - threshold) <= RECOUNT_MARGIN * sketch.standard_error()]
+    if near_threshold:
+        print(f"Recounting {near_threshold} exactly near entropy {threshold}")
+        counts.update(count_values(input_file, chunksize, set(near_threshold)))
+
+    entropies = {col: entropy(typed_counts(counts[col])) if col in counts else sketches[col].estimate()
+                 for col in columns}
+    write_entropies(entropies, outfpath)
+
+
+def analyze_native(input_file, outfpath, threads=None, executable=NATIVE_EXECUTABLE):
+    """ Analyse input file with the compiled entropy calculator, write output file """
+    command = [executable, input_file, outfpath]
+    if threads:
+        command.append(str(threads))
+    subprocess.run(command, check=True)
+
+
+def analyze(input_file, outfpath, chunksize=None, epsilon=None, exact_limit=EXACT_LIMIT, backend=PANDAS,
+            threshold=SIBACO_THRESHOLD):
+    """
+    Analyse input file, write output file
+    chunksize : stream the input in chunks of this many rows instead of loading it whole
+    epsilon : estimate columns with more than exact_limit distinct values with this standard error (nats), recounting
+    the ones that could fall on either side of the SIBACO threshold exactly
+    backend : PANDAS, or NATIVE to run the multithreaded entropy_calculator (chunksize and epsilon do not apply)
+    """
+    mode = NATIVE if backend == NATIVE else "sketch" if epsilon else "chunks" if chunksize else None
+    if mode is not None:
+        with compass_telemetry.stage("entropy", table=input_file, mode=mode):
+            if backend == NATIVE:
+                analyze_native(input_file, outfpath)
+            elif epsilon:
+                analyze_approximate(input_file, outfpath, chunksize or DEFAULT_CHUNKSIZE, epsilon, exact_limit,
+                                    threshold)
+            else:
+                analyze_chunks(input_file, outfpath, chunksize)
+        return
+
+    with compass_telemetry.stage("read", table=input_file):
+        df = read_table(input_file)
+    analyze_frame(df, outfpath)
+
+
+def read_table(input_file):
+    """ Load an input file or a directory of CSV files whole """
+    return compass_ingest.read_table(input_file)
+
+
+def analyze_frame(df, outfpath):
+    """ Analyse an already loaded table, write output file """
+    with compass_telemetry.stage("entropy", mode="frame"):
+        entropies = {col: shannon_entropy(df[col]) for col in df}
+    # Write output
+    write_entropies(entropies, outfpath)
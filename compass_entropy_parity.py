@@ -0,0 +1,95 @@
+"""
+compass_entropy_parity.py
+Purpose: Check that the native entropy backend writes the same entropy file as the pandas backend.
+Without input files it runs on a set of generated CSV edge cases (quoted fields, embedded line breaks, missing
+values, mixed numbers, directories whose files have different columns).
+"""
+
+import argparse
+import csv
+import math
+import os
+import sys
+import tempfile
+
+import compass_entropy
+
+FIXTURES = {
+    "plain.csv": "id,station,value\n1,A,0.5\n2,B,0.5\n3,A,1.5\n4,C,2.0\n",
+    "quoted.csv": 'id,note,"a, b"\n1,"x, y",1\n2,"say ""hi""",1\n3,"x, y",2\n4,"two\nlines",2\n',
+    "missing.csv": "id,value,label\n1,,NA\n2,3,null\n3,3,a\n4,,a\n5,NaN,\n",
+    "numbers.csv": "a,b,c\n1,1.0,True\n01,1,False\n1,1.00,true\n2,2e0,False\n",
+    "crlf.csv": "a,b\r\n1,x\r\n1,y\r\n2,x\r\n",
+    "empty.csv": "a,b\n,\n,\n",
+    "shards/part_1.csv": "id,value\n1,a\n2,b\n",
+    "shards/part_2.csv": "id,value,extra\n3,a,z\n4,a,z\n",
+    # Text and integer columns missing from some shards
+    "mixed_shards/part_1.csv": "id,station,note,level\n1,A,ok,1\n2,B,ok,2\n3,A,,2\n",
+    "mixed_shards/part_2.csv": "id,station,level\n4,C,3\n5,A,1\n",
+    "mixed_shards/part_3.csv": "id,note\n6,late\n7,ok\n",
+}
+
+
+def write_fixtures(directory):
+    """ Write the edge case CSV files, return the inputs to check """
+    inputs = []
+    for name, content in FIXTURES.items():
+        path = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", newline='') as f:
+            f.write(content)
+        if os.path.dirname(name):
+            path = os.path.dirname(path)
+        if path not in inputs:
+            inputs.append(path)
+    return inputs
+
+
+def read_entropy_file(path):
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    return rows
+
+
+def compare(input_file, tolerance):
+    """ Run both backends on input_file, return a list of differences """
+    with tempfile.TemporaryDirectory() as out_dir:
+        pandas_file = os.path.join(out_dir, "pandas.csv")
+        native_file = os.path.join(out_dir, "native.csv")
+        compass_entropy.analyze(input_file, pandas_file, backend=compass_entropy.PANDAS)
+        compass_entropy.analyze(input_file, native_file, backend=compass_entropy.NATIVE)
+        expected = read_entropy_file(pandas_file)
+        actual = read_entropy_file(native_file)
+
+    if len(actual) != 2 or actual[0] != expected[0]:
+        return [f"header/rows differ: pandas {expected}, native {actual}"]
+    differences = []
+    for name, want, got in zip(expected[0], expected[1], actual[1]):
+        if not math.isclose(float(want), float(got), rel_tol=tolerance, abs_tol=tolerance):
+            differences.append(f"{name}: pandas {want}, native {got}")
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the pandas and native entropy backends.')
+    parser.add_argument('input_files', nargs='*', help='CSV files or directories, default: generated edge cases')
+    parser.add_argument('--tolerance', type=float, default=1e-9, help='Allowed relative/absolute difference')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as fixture_dir:
+        inputs = args.input_files or write_fixtures(fixture_dir)
+        failed = 0
+        for input_file in inputs:
+            differences = compare(input_file, args.tolerance)
+            status = "OK" if not differences else "MISMATCH"
+            print(f"{status}: {os.path.basename(input_file)}")
+            for difference in differences:
+                print(f"    {difference}")
+            failed += bool(differences)
+
+    print(f"{len(inputs) - failed}/{len(inputs)} inputs match")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
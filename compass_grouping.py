@@ -0,0 +1,86 @@
+"""
+compass_grouping.py
+Purpose: Search column groupings that minimize the measured cost of compressing them, instead of clustering column
+features and measuring compression afterwards.
+
+A SubsetScorer compresses a row sample of a column subset, serialized like a partition, and caches the cost of every
+subset it has seen, so each subset is compressed at most once across the whole search and across cluster counts.
+Two searches build n_clusters groups from these costs:
+- agglomerative: start from one group per column and repeatedly merge the two groups whose merge saves the most
+- greedy: seed one group with each of the n_clusters most expensive columns, then add every other column to the
+  group where it costs the least extra
+"""
+
+import compass_recording
+
+AGGLOMERATIVE = "agglomerative"
+GREEDY = "greedy"
+# Cost of a subset, minimized by the search
+SIZE = "size"
+DECOMPRESS = "decompress"
+DEFAULT_SAMPLE_ROWS = 10000
+
+
+class SubsetScorer:
+    """ Cached compression cost of column subsets of a row sample of df """
+
+    def __init__(self, df, codec=("gzip", 6), objective=SIZE, sample_rows=DEFAULT_SAMPLE_ROWS):
+        self.sample = df if len(df) <= sample_rows else df.sample(n=sample_rows, random_state=42).sort_index()
+        self.columns = list(df.columns)
+        self.codec = codec
+        self.objective = objective
+        self.scores = {}
+
+    def score(self, columns):
+        """ Compressed bytes, or decompression seconds, of the sample of columns """
+        key = frozenset(columns)
+        if key not in self.scores:
+            # Serialize in table order, as write_clusters does
+            data = compass_recording.serialize_partition(self.sample, [col for col in self.columns if col in key])
+            size, _, decompress_time = compass_recording.measure_buffer(data, self.codec)
+            self.scores[key] = size if self.objective == SIZE else decompress_time
+        return self.scores[key]
+
+    def cost(self, groups):
+        """ Total cost of a grouping """
+        return sum(self.score(group) for group in groups)
+
+
+def agglomerative(scorer, columns, n_clusters):
+    """ Merge the pair of groups with the largest saving until n_clusters groups are left """
+    groups = [frozenset([col]) for col in columns]
+    while len(groups) > n_clusters:
+        best = None
+        for i in range(len(groups)):
+            for j in range(i + 1, len(groups)):
+                saving = scorer.score(groups[i]) + scorer.score(groups[j]) - scorer.score(groups[i] | groups[j])
+                if best is None or saving > best[0]:
+                    best = saving, i, j
+        _, i, j = best
+        groups[i] = groups[i] | groups.pop(j)
+    return groups
+
+
+def greedy(scorer, columns, n_clusters):
+    """ Seed a group with each of the n_clusters most expensive columns, add each other column where it costs least """
+    ordered = sorted(columns, key=lambda col: scorer.score([col]), reverse=True)
+    groups = [frozenset([col]) for col in ordered[:n_clusters]]
+    for col in ordered[n_clusters:]:
+        extra = [scorer.score(group | {col}) - scorer.score(group) for group in groups]
+        best = extra.index(min(extra))
+        groups[best] = groups[best] | {col}
+    return groups
+
+
+def search(scorer, n_clusters, method=AGGLOMERATIVE):
+    """
+    Group the columns of the scorer into at most n_clusters groups
+    return : cluster index of every column in table order, numbered by first appearance, like KMeans labels
+    """
+    columns = scorer.columns
+    groups = (greedy if method == GREEDY else agglomerative)(scorer, columns, min(n_clusters, len(columns)))
+    group_of = {col: group for group in groups for col in group}
+    numbers = {}
+    for col in columns:
+        numbers.setdefault(group_of[col], len(numbers))
+    return [numbers[group_of[col]] for col in columns]
@@ -0,0 +1,237 @@
+"""
+compass_ingest.py
+Purpose: Parallel loading of a directory of CSV files, such as sharded daily exports, into one table.
+
+The files are parsed concurrently in a process pool, in batches so that hundreds of small files do not cost one
+round trip each. The column set is the union of the file headers in order of first appearance and every column gets
+one dtype for all files, the one pd.concat would give it (integers missing from a file become float64, booleans
+missing from a file or mixed with other types become object). read_directory copies the parsed files column by column
+into a single preallocated frame, dropping each file column once it is copied, so peak memory stays close to the size
+of the table instead of the twice its size of concatenating whole frames. iter_directory yields the files one by one,
+whole or in chunks of bounded rows, aligned on the union of the file columns, for consumers that stream such as the
+chunked, sketched and approximate entropy of compass_entropy.
+
+read_table is the loading layer of every whole-table read. Unless COMPASS_DTYPES=default, files are loaded with
+compact dtypes inferred from a sample of rows: text columns with few distinct values become categoricals (the
+categories of several files are unioned) and numeric columns take the smallest dtype that holds their values exactly.
+Values, and so entropies and serialized partitions, are the same as with the pandas defaults.
+"""
+
+import glob
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+# Files parsed per task in the pool
+BATCH_FILES = 8
+# Rows parsed to infer the compact dtypes of a file
+DTYPE_SAMPLE_ROWS = 10000
+# Text columns with at most this share of distinct values in the sample are loaded as categoricals
+CATEGORY_MAX_RATIO = 0.5
+COMPACT = os.environ.get("COMPASS_DTYPES", "compact") != "default"
+
+
+def configure(compact):
+    """ Load with compact or pandas default dtypes, in this process and in the processes it starts """
+    global COMPACT
+    COMPACT = compact
+    os.environ["COMPASS_DTYPES"] = "compact" if compact else "default"
+
+
+def csv_files(directory):
+    """ CSV files of a directory in name order, the order every loader and the native entropy calculator read them """
+    return sorted(glob.glob(directory + "/*.csv"))
+
+
+def categorical_columns(sample):
+    """ read_csv dtypes of the text columns of a sample with few enough distinct values to be categoricals """
+    dtypes = {}
+    for col in sample.columns:
+        series = sample[col]
+        if pd.api.types.is_string_dtype(series.dtype) and series.nunique() <= CATEGORY_MAX_RATIO * len(series):
+            dtypes[col] = "category"
+    return dtypes
+
+
+def downcast(df):
+    """ Give every numeric column of df, in place, the smallest dtype that holds its values exactly """
+    for col in df.columns:
+        dtype = df[col].dtype
+        if not isinstance(dtype, np.dtype):
+            continue
+        if dtype.kind in "iu":
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+        elif dtype.kind == "f" and dtype.itemsize > 4:
+            values = df[col].to_numpy()
+            with np.errstate(over="ignore"):
+                narrow = values.astype(np.float32)
+            if np.array_equal(narrow, values, equal_nan=True):
+                df[col] = narrow
+    return df
+
+
+def read_file(file, compact=None):
+    """ Parse one CSV file, with compact dtypes unless compact is False """
+    if not (COMPACT if compact is None else compact):
+        return pd.read_csv(file, sep=',', header=0)
+    sample = pd.read_csv(file, sep=',', header=0, nrows=DTYPE_SAMPLE_ROWS)
+    dtypes = categorical_columns(sample)
+    if len(sample) < DTYPE_SAMPLE_ROWS:
+        # The sample is the whole file
+        return downcast(sample.astype(dtypes))
+    del sample
+    return downcast(pd.read_csv(file, sep=',', header=0, dtype=dtypes))
+
+
+def _parse_batch(files, compact=None):
+    return [read_file(file, compact) for file in files]
+
+
+def parse_files(files, jobs=None, compact=None):
+    """ Yield the DataFrame of every file in order, parsing batches of files concurrently """
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(files) <= 1:
+        for file in files:
+            yield read_file(file, compact)
+        return
+    batches = [files[start:start + BATCH_FILES] for start in range(0, len(files), BATCH_FILES)]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(batches))) as executor:
+        for frames in executor.map(_parse_batch, batches, repeat(compact)):
+            yield from frames
+
+
+def column_dtype(dtypes, in_all_files):
+    """ dtype pd.concat gives a column with the dtypes of its files, NaN-filled where it is missing """
+    if len(set(dtypes)) == 1 and in_all_files:
+        return dtypes[0]
+    if all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+        # Compact loads: the categories of the files are unioned
+        return pd.CategoricalDtype()
+    if not all(isinstance(dtype, np.dtype) for dtype in dtypes):
+        # pandas extension dtypes, such as nullable integers or strings
+        return dtypes[0] if len(set(dtypes)) == 1 else np.dtype("object")
+    kinds = {dtype.kind for dtype in dtypes}
+    if kinds <= {"i", "u", "f"}:
+        if kinds <= {"i", "u"} and in_all_files:
+            return np.result_type(*dtypes)
+        return np.dtype("float64")
+    return np.dtype("object")
+
+
+def reconcile(frames):
+    """ Union of the columns of frames in order of first appearance, with the dtype of each column """
+    dtypes = {}
+    for frame in frames:
+        for col, dtype in frame.dtypes.items():
+            dtypes.setdefault(col, []).append(dtype)
+    return {col: column_dtype(col_dtypes, len(col_dtypes) == len(frames)) for col, col_dtypes in dtypes.items()}
+
+
+def _concat_categoricals(parts):
+    """
+    Union of categorical parts, where the parts of the files without the column are all NaN; the categories are
+    unioned as objects if their dtypes differ between files
+    """
+    dtypes = {part.dtype.categories.dtype for part in parts if isinstance(part.dtype, pd.CategoricalDtype)}
+    categories_dtype = dtypes.pop() if len(dtypes) == 1 else np.dtype("object")
+    categoricals = []
+    for part in parts:
+        if isinstance(part.dtype, pd.CategoricalDtype):
+            codes, categories = part.array.codes, part.array.categories.astype(categories_dtype)
+        else:
+            codes, categories = np.full(len(part), -1), pd.Index([], dtype=categories_dtype)
+        categoricals.append(pd.Categorical.from_codes(codes, categories=categories))
+    return pd.Series(pd.api.types.union_categoricals(categoricals))
+
+
+def read_directory(directory, jobs=None, compact=None):
+    """ Load all CSV files of a directory into one frame, like pd.concat of every file with ignore_index=True """
+    frames = list(parse_files(csv_files(directory), jobs, compact))
+    if not frames:
+        raise ValueError(f"No objects to concatenate: no CSV files in {directory}")
+    schema = reconcile(frames)
+    offsets = np.cumsum([0] + [len(frame) for frame in frames])
+
+    data = {}
+    for col, dtype in schema.items():
+        if not isinstance(dtype, np.dtype):
+            parts = [frame.pop(col) if col in frame else pd.Series(np.nan, index=range(len(frame))) for frame in frames]
+            if isinstance(dtype, pd.CategoricalDtype):
+                data[col] = _concat_categoricals(parts)
+            else:
+                data[col] = pd.concat(parts, ignore_index=True).astype(dtype)
+            continue
+        values = np.empty(offsets[-1], dtype=dtype)
+        if dtype.kind in "fO":
+            values[:] = np.nan
+        for frame, start, end in zip(frames, offsets[:-1], offsets[1:]):
+            if col in frame:
+                values[start:end] = frame[col].to_numpy(dtype=dtype)
+                # The file column is not needed any more
+                del frame[col]
+        data[col] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def _read_chunks(files, chunksize, usecols=None, dtype=None):
+    for file in files:
+        with pd.read_csv(file, sep=',', header=0, chunksize=chunksize, usecols=usecols, dtype=dtype) as reader:
+            yield from reader
+
+
+def iter_directory(directory, chunksize=None, usecols=None, dtype=None, jobs=None):
+    """
+    Yield the CSV files of a directory as chunks with the union of all file columns, or of those usecols accepts
+    Only the headers are read ahead, so chunk dtypes are those of each file, or dtype; missing columns are NaN.
+    Without chunksize the files are parsed concurrently and yielded whole, else read one by one in chunks of at most
+    chunksize rows.
+    usecols : callable taking a column name, as for pd.read_csv
+    """
+    files = csv_files(directory)
+    columns = []
+    for file in files:
+        columns.extend(col for col in pd.read_csv(file, nrows=0).columns if col not in columns)
+    if usecols is not None:
+        columns = [col for col in columns if usecols(col)]
+    if chunksize is None:
+        frames = parse_files(files, jobs)
+    else:
+        frames = _read_chunks(files, chunksize, usecols, dtype)
+    for frame in frames:
+        yield frame.reindex(columns=columns)
+
+
+def _megabytes(n_bytes):
+    return round(n_bytes / 1024 ** 2, 1)
+
+
+def report_memory(in_file, df, compact):
+    """ Print the memory held by a loaded table and the peak memory so far, with an estimate for default dtypes """
+    held = df.memory_usage(deep=True, index=False).sum()
+    estimate = ""
+    if compact:
+        first_file = csv_files(in_file)[0] if os.path.isdir(in_file) else in_file
+        sample = pd.read_csv(first_file, sep=',', header=0, nrows=DTYPE_SAMPLE_ROWS)
+        default = sample.memory_usage(deep=True, index=False).sum() / max(len(sample), 1) * len(df)
+        estimate = f" (about {_megabytes(default)} MB with default dtypes)"
+    # kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(f"Loaded {in_file}: {len(df)} rows, {_megabytes(held)} MB in memory{estimate}, "
+          f"peak RSS {_megabytes(peak)} MB")
+
+
+def read_table(in_file, jobs=None, compact=None):
+    """ Load an input file or a directory of CSV files whole """
+    df_in = []
+    if os.path.isdir(in_file):
+        # Parse the CSV files in parallel into one preallocated DataFrame
+        df_in = read_directory(in_file, jobs, compact)
+    if os.path.isfile(in_file):
+        df_in = read_file(in_file, compact)
+    if len(df_in) > 0:
+        report_memory(in_file, df_in, COMPACT if compact is None else compact)
+    return df_in
@@ -1,86 +1,68 @@
+import argparse
 import os
-import tempfile
-import zipfile
+import re
 
+import numpy as np
 import pandas as pd
-import glob
-import sys
+import compass_cache
+import compass_codecs
 import compass_entropy
+import compass_grouping
+import compass_ingest
+import compass_profile
 import compass_recording
-import compass_clean_results
-
-from sklearn.cluster import KMeans
-from sklearn.compose import ColumnTransformer
-from sklearn.impute import SimpleImputer
-from sklearn.metrics import silhouette_score
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import StandardScaler, OrdinalEncoder
-
-
-def usage():
-    """ Print usage and exit """
-    print("Usage: split_files.py <input_file.csv or directory> entropy_file.csv results.csv <num of clusters>")
-    sys.exit()
-
-
-def split_columns(in_file, header, out_file, label, n_clusters, tmp_dir):
-    """ Analyze input file, write output file """
-    global df
-    if os.path.isdir(in_file):
-        # Get CSV files list from a folder
-        csv_files = glob.glob(in_file + "/*.csv")
-
-        # Read each CSV file into DataFrame
-        # This creates a list of dataframes
-        df_list = (pd.read_csv(file) for file in csv_files)
-
-        # Concatenate all DataFrames
-        df = pd.concat(df_list, ignore_index=True)
-    if os.path.isfile(in_file):
-        df = pd.read_csv(in_file, sep=',', header=0)
-    single_file = f"{tmp_dir}/{os.path.basename(in_file).replace('.csv', '')}_full.csv"
-    df.to_csv(single_file, index=False, header=True, mode='a')
-    # Define target File name
-    split_target_file = f"{tmp_dir}/{os.path.basename(in_file).replace('.csv', '')}_{label}.1.csv"
-    split_rest_file = f"{tmp_dir}/{os.path.basename(in_file).replace('.csv', '')}_{label}.2.csv"
-    # Write to the file using pandas to_csv
-    df.to_csv(split_target_file, index=False, columns=header, header=True, mode='a')
-    usecols = list(set(df.columns.tolist()) - set(header))
-    compass_recording.compress_and_record_size(split_target_file, split_target_file, label, zipfile.ZIP_DEFLATED,
-                                               out_file, 1)
-    compass_recording.compress_and_record_size(split_target_file, split_target_file, label, zipfile.ZIP_BZIP2, out_file,
-                                               1)
-    compass_recording.compress_and_record_size(split_target_file, split_target_file, label, zipfile.ZIP_LZMA, out_file,
-                                               1)
-    df.to_csv(split_rest_file, index=False, columns=usecols, header=True, mode='a')
-    compass_recording.compress_and_record_size(split_rest_file, split_rest_file, label, zipfile.ZIP_DEFLATED, out_file,
-                                               2)
-    compass_recording.compress_and_record_size(split_rest_file, split_rest_file, label, zipfile.ZIP_BZIP2, out_file, 2)
-    compass_recording.compress_and_record_size(split_rest_file, split_rest_file, label, zipfile.ZIP_LZMA, out_file, 2)
-    compass_recording.compress_and_record_size(single_file, single_file, label, zipfile.ZIP_DEFLATED, out_file, 0)
-    compass_recording.compress_and_record_size(single_file, single_file, label, zipfile.ZIP_BZIP2, out_file, 0)
-    compass_recording.compress_and_record_size(single_file, single_file, label, zipfile.ZIP_LZMA, out_file, 0)
+import compass_silhouette
+import compass_telemetry
+
+# Column features clustered by COMPASS_KMEANS_DATA
+FULL = "full"
+SAMPLE = "sample"
+PROFILE = "profile"
+DEFAULT_SAMPLE_ROWS = 10000
+PROFILE_QUANTILES = [0, 0.05, 0.25, 0.5, 0.75, 0.95, 1]
+PROFILE_TOP_VALUES = 5
+# Entropy below which SIBACO puts a column in its low-entropy group
+SIBACO_THRESHOLD = compass_entropy.SIBACO_THRESHOLD
+
+
+def load_table(in_file, cache_dir=None, cache_max_bytes=compass_cache.DEFAULT_MAX_BYTES):
+    """ Read an input file or a directory of CSV files into one DataFrame, through the columnar cache if given """
+    with compass_telemetry.stage("read", table=in_file, cached=bool(cache_dir)):
+        if cache_dir:
+            return compass_cache.load(in_file, cache_dir, cache_max_bytes)
+        return compass_cache.read_csv(in_file)
+
+
+def split_columns(in_file, header, out_file, label, n_clusters, recorder=None, df=None):
+    """ Analyze input file, record the compressed size of the header columns, the other columns and the full table """
+    if df is None:
+        df = load_table(in_file)
+    if recorder is None:
+        recorder = compass_recording.ResultRecorder()
+    table_name = os.path.basename(in_file).replace('.csv', '')
+    usecols = [col for col in df.columns.tolist() if col not in header]
+    # Each partition is serialized once in memory and shared by all compression methods
+    recorder.record_frame(df, header, f"{table_name}_{label}.1.csv", label, out_file, 1)
+    recorder.record_frame(df, usecols, f"{table_name}_{label}.2.csv", label, out_file, 2)
+    recorder.record_frame(df, None, f"{table_name}_full.csv", label, out_file, 0)
 
 
 # Function : file_compress
 # Select the compression mode ZIP_DEFLATED for compression
 # or zipfile.ZIP_STORED to just store the file
 
-def split_all(in_file):
-    """ Analyse input file, write output file """
-    df = pd.read_csv(in_file, sep=',', header=0)
-    # Loop through all columns
-    for label in df.columns.tolist():
-        # Create another sub data frame using the value for the value of the column each time
-        df_label = df[label]
-        # Define target File name
-        split_target_file = f"{in_file.replace('.csv', '')}_{label}.csv"
-
-        # Write to the file using pandas to_csv
-        df_label.to_csv(split_target_file, index=False, header=True, mode='a')
+def split_all(in_file, out_file, label, key, recorder=None, df_tmp=None, partitions=None):
+    """
+    Full-table baseline of the hybrid layouts: split the rows by every value of the key column and record each row
+    partition with all its columns, through the same cells as split_rows_and_columns
+    """
+    if df_tmp is None:
+        df_tmp = load_table(in_file)
+    split_rows_and_columns(in_file, out_file, label, key, [0] * len(df_tmp.columns), recorder, df_tmp, partitions)
 
 
-def split_column_per_unique_values(df_in, split_source_file, column_chosen):
+def find_column(df_in, column_chosen):
+    """ Actual name of a column, matched case-insensitively """
     # Extract only the columns of the DataFrame
     columns = df_in.columns.values.tolist()
 
@@ -88,35 +70,68 @@ def split_column_per_unique_values(df_in, split_source_file, column_chosen):
     columns_list = list(pd.Series(columns).str.upper())
 
     # Find the index value of the column
-    indx_val = columns_list.index(column_chosen.upper())
-
-    # Take the column to split from the actual column names of data frame
-    column_to_split = columns[indx_val]
-
-    # Find unique values from the column
-    unique_values = df_in[column_to_split].unique()
-
-    # Loop through all unique values
-    for label in unique_values:
-        # Create another sub data frame using the value for the value of the column each time
-        df_label = df_in[df_in[column_to_split] == label]
-        # Define target File name
-        split_target_file = f"{split_source_file.replace('.csv', '')}_{label}.csv"
-
-        # Write to the file using pandas to_csv
-        df_label.to_csv(split_target_file, index=False, header=True, mode='a')
-
-
-def preprocess_and_cluster(df_in, n_clusters, label):
-    """ Preprocess data and apply KMeans clustering """
-    df_processed = df_in.copy()
+    return columns[columns_list.index(column_chosen.upper())]
+
+
+def row_partitions(df_in, key):
+    """ Row positions of every value of the key column, in order of first appearance, in a single pass """
+    with compass_telemetry.stage("partition", key=key):
+        return df_in.groupby(key, sort=False, dropna=False, observed=True).indices
+
+
+def partition_name(key, value):
+    """ key=value of a row partition, with the characters that cannot go in a results row or a file name replaced """
+    return re.sub(r'[^\w.=-]+', '_', f"{key}={value}")
+
+
+def split_rows_and_columns(in_file, out_file, label, key, clusters, recorder=None, df_tmp=None, partitions=None):
+    """
+    Hybrid layout: split the rows by every value of the key column, then each row partition by the column clusters,
+    and record every cell once. Cells leave out the key column, whose value the row partition implies and the cell
+    name records. Cells are numbered <row partition>.<column cluster> in the results.
+    partitions : row_partitions of the key column, computed once per sweep
+    """
+    if df_tmp is None:
+        df_tmp = load_table(in_file)
+    if recorder is None:
+        recorder = compass_recording.ResultRecorder()
+    key = find_column(df_tmp, key)
+    if partitions is None:
+        partitions = row_partitions(df_tmp, key)
+    table_name = os.path.basename(in_file).replace('.csv', '')
+    cluster_groups = group_columns(df_tmp.columns, clusters)
+    for row_idx, (value, rows) in enumerate(partitions.items()):
+        df_rows = df_tmp.take(rows)
+        for cluster_idx, columns in cluster_groups.items():
+            columns = [col for col in columns if col != key]
+            if not columns:
+                continue
+            cell_name = (f"{table_name}_{label}_part_{row_idx + 1}_{partition_name(key, value)}"
+                         f"_cluster_{cluster_idx + 1}.csv")
+            recorder.record_frame(df_rows, columns, cell_name, label, out_file, f"{row_idx + 1}.{cluster_idx + 1}")
+
+
+def feature_columns(df_in):
+    """ Separate numerical and categorical columns, in the order their feature rows are produced """
+    numeric_cols = df_in.select_dtypes(include=['number']).columns
+    categorical_cols = df_in.select_dtypes(include=['object', 'category']).columns
+    return numeric_cols, categorical_cols
+
+
+def preprocess(df_in):
+    """ Preprocess data into one scaled feature row per column """
+    from sklearn.compose import ColumnTransformer
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import FunctionTransformer, StandardScaler, OrdinalEncoder
 
     # Separate numerical and categorical columns
-    numeric_cols = df_processed.select_dtypes(include=['number']).columns
-    categorical_cols = df_processed.select_dtypes(include=['object']).columns
+    numeric_cols, categorical_cols = feature_columns(df_in)
 
     # Create pipelines for numerical and categorical preprocessing
     numeric_pipeline = Pipeline([
+        # Compact float32 and small integer columns are scaled in float64, as with the default dtypes
+        ('float64', FunctionTransformer(np.asarray, kw_args={'dtype': np.float64})),
         ('imputer', SimpleImputer(strategy='constant')),  # Impute missing values with constant
         ('scaler', StandardScaler())  # Standardize numerical features
     ])
@@ -133,124 +148,484 @@ def preprocess_and_cluster(df_in, n_clusters, label):
             ('cat', categorical_pipeline, categorical_cols)
         ])
 
-    if len(df_processed) <= 0:
-        return {}
-    # Apply preprocessing pipeline to the transposed DataFrame
-    preprocessed = preprocessor.fit_transform(df_processed)
+    # Apply preprocessing pipeline to the DataFrame, the transformers do not modify it
+    preprocessed = preprocessor.fit_transform(df_in)
 
-    # Standardize the data
-    scaler = StandardScaler()
-    processed = scaler.fit_transform(preprocessed.transpose())
+    # Standardize the transposed data in place, the transpose is a view of the preprocessed array
+    scaler = StandardScaler(copy=False)
+    return scaler.fit_transform(preprocessed.transpose())
 
-    # Apply KMeans clustering
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    clusters = kmeans.fit_predict(processed)
 
-    if len(df_processed.columns) == n_clusters:
-        silhouette_avg = 0
-        print(f"{label}: n_clusters = {n_clusters}, the average silhouette_score, {silhouette_avg}")
-        return clusters
-    # Calculate Silhouette Score
-    silhouette_avg = silhouette_score(processed, clusters)
+def log_silhouette(label, n_clusters, silhouette_avg):
     print(f"{label}: n_clusters = {n_clusters}, the average silhouette_score, {silhouette_avg}")
 
+
+def reuse_clusters(grouping, label, n_clusters):
+    """ Clusters stored for label by an earlier incremental run, or None """
+    if grouping is None or label not in grouping:
+        return None
+    clusters, silhouette_avg = grouping[label]
+    print(f"{label}: reusing the clusters of the previous run")
+    log_silhouette(label, n_clusters, silhouette_avg)
     return clusters
 
 
-def split_columns_per_entropy_cluster(in_file, out_file, label, n_clusters, tmp_dir):
-    """ Analyze input file, write output file """
-    df_tmp = pd.read_csv(in_file)
-    # Read entropy for each column
+def sample_rows(df_in, n_rows):
+    """ Fixed-size random sample of the rows, kept in table order """
+    if len(df_in) <= n_rows:
+        return df_in
+    return df_in.sample(n=n_rows, random_state=42).sort_index()
+
+
+def profile_features(df_in):
+    """
+    Summarize every column in a fixed number of features, independent of the number of rows:
+    quantiles of the standardized numeric values, missing fraction, cardinality and the top value frequencies
+    """
+    from sklearn.preprocessing import StandardScaler
+
+    numeric_cols, categorical_cols = feature_columns(df_in)
+    profiles = []
+    for col in list(numeric_cols) + list(categorical_cols):
+        series = df_in[col]
+        frequencies = series.value_counts(normalize=True).to_numpy()[:PROFILE_TOP_VALUES]
+        frequencies = np.pad(frequencies, (0, PROFILE_TOP_VALUES - len(frequencies)))
+        quantiles = np.zeros(len(PROFILE_QUANTILES))
+        values = series.dropna()
+        if col in numeric_cols:
+            values = values.astype(np.float64)
+        if col in numeric_cols and len(values) > 0 and values.std() > 0:
+            quantiles = ((values - values.mean()) / values.std()).quantile(PROFILE_QUANTILES).to_numpy()
+        cardinality = series.nunique()
+        profiles.append([*quantiles, series.isna().mean(), cardinality / max(len(series), 1), np.log1p(cardinality),
+                         *frequencies, float(col in numeric_cols)])
+
+    # Standardize each profile feature across the columns
+    scaler = StandardScaler()
+    return scaler.fit_transform(np.array(profiles, dtype=float))
+
+
+def column_features(df_in, mode=FULL, sample_size=DEFAULT_SAMPLE_ROWS):
+    """ Feature rows clustered by KMEANS_DATA: all rows (FULL), a row sample (SAMPLE) or column profiles (PROFILE) """
+    with compass_telemetry.stage("preprocess", mode=mode):
+        if mode == SAMPLE:
+            return preprocess(sample_rows(df_in, sample_size))
+        if mode == PROFILE:
+            return profile_features(sample_rows(df_in, sample_size))
+        return preprocess(df_in)
+
+
+def report_agreement(clusters, full_processed, n_clusters, label):
+    """ Print how closely the clusters chosen by cluster_features agree with the clusters of the full data """
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import adjusted_rand_score
+
+    full_clusters = KMeans(n_clusters=n_clusters, random_state=42).fit_predict(full_processed)
+    agreement = adjusted_rand_score(full_clusters, clusters)
+    print(f"{label}: agreement with full-data clustering, adjusted_rand_score, {agreement}")
+    return agreement
+
+
+def cluster_features(processed, n_clusters, label, grouping=None, silhouette=None):
+    """
+    Apply KMeans clustering on preprocessed column features, storing the clusters in grouping if given
+    silhouette : compass_silhouette.Silhouette of processed, shared by the calls of a sweep
+    """
+    from sklearn.cluster import KMeans
+
+    with compass_telemetry.stage("kmeans", label=label, k=n_clusters):
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+        clusters = kmeans.fit_predict(processed)
+
+    if len(processed) == n_clusters:
+        silhouette_avg = 0
+    else:
+        # Calculate Silhouette Score
+        if silhouette is None:
+            silhouette = compass_silhouette.Silhouette(processed)
+        with compass_telemetry.stage("silhouette", label=label, k=n_clusters):
+            silhouette_avg = silhouette.score(clusters)
+    log_silhouette(label, n_clusters, silhouette_avg)
+
+    if grouping is not None:
+        grouping[label] = (clusters.tolist(), silhouette_avg)
+    return clusters
+
+
+def preprocess_and_cluster(df_in, n_clusters, label, grouping=None):
+    """ Preprocess data and apply KMeans clustering """
+    if len(df_in) <= 0:
+        return {}
+    return cluster_features(preprocess(df_in), n_clusters, label, grouping)
+
+
+def scale_entropies(en_file):
+    """ Read the entropy of each column and standardize it """
+    from sklearn.preprocessing import StandardScaler
+
     # Read entropy data from CSV file into a DataFrame
-    entropies = pd.read_csv(entropy_file)
+    entropies = pd.read_csv(en_file)
 
     # Standardize the data
     scaler = StandardScaler()
-    scaled_entropy = scaler.fit_transform(entropies.transpose())
+    return scaler.fit_transform(entropies.transpose())
+
+
+def cluster_entropies(scaled_entropy, n_clusters, label, grouping=None, silhouette=None):
+    """
+    Apply KMeans clustering on the scaled column entropies, storing the clusters in grouping if given
+    silhouette : compass_silhouette.Silhouette of scaled_entropy, shared by the calls of a sweep
+    """
+    from sklearn.cluster import KMeans
 
-    # Apply KMeans clustering
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    clusters = kmeans.fit_predict(scaled_entropy)
+    with compass_telemetry.stage("kmeans", label=label, k=n_clusters):
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+        clusters = kmeans.fit_predict(scaled_entropy)
 
-    if len(entropies.columns) <= n_clusters or clusters.min() == clusters.max():
+    if len(scaled_entropy) <= n_clusters or clusters.min() == clusters.max():
         silhouette_avg = 0
     else:
-        silhouette_avg = silhouette_score(scaled_entropy, clusters)
-    print(f"{label}: n_clusters = {n_clusters}, the average silhouette_score, {silhouette_avg}")
+        if silhouette is None:
+            silhouette = compass_silhouette.Silhouette(scaled_entropy)
+        with compass_telemetry.stage("silhouette", label=label, k=n_clusters):
+            silhouette_avg = silhouette.score(clusters)
+    log_silhouette(label, n_clusters, silhouette_avg)
+
+    if grouping is not None:
+        grouping[label] = (clusters.tolist(), silhouette_avg)
+    return clusters
 
-    # Group column names by cluster
+
+def group_columns(columns, clusters):
+    """ Column names of each cluster, in order of first appearance """
     cluster_groups = {}
-    for cluster_idx, col_name in zip(clusters, df_tmp.columns):
+    for cluster_idx, col_name in zip(clusters, columns):
         if cluster_idx not in cluster_groups:
             cluster_groups[cluster_idx] = [col_name]
         else:
             cluster_groups[cluster_idx].append(col_name)
+    return cluster_groups
 
-    # Write data for each cluster to a single CSV file
-    for cluster_idx, columns in cluster_groups.items():
-        cluster_df = df_tmp[columns]
-        cluster_file = f"{tmp_dir}/{os.path.basename(in_file).replace('.csv', '')}_{label}_cluster_{cluster_idx + 1}.csv"
-        cluster_df.to_csv(cluster_file, index=False, header=True)
 
+def write_clusters(df_tmp, clusters, in_file, out_file, label, recorder=None):
+    """ Serialize each cluster of columns, compress it and record its size """
+    if recorder is None:
+        recorder = compass_recording.ResultRecorder()
+    # Group column names by cluster
+    cluster_groups = group_columns(df_tmp.columns, clusters)
+
+    # Record the data of each cluster as a single CSV partition
+    for cluster_idx, columns in cluster_groups.items():
+        cluster_name = f"{os.path.basename(in_file).replace('.csv', '')}_{label}_cluster_{cluster_idx + 1}.csv"
         # Compress and record size for each compression method
-        compass_recording.compress_and_record_size(cluster_file, cluster_file, label, zipfile.ZIP_DEFLATED, out_file,
-                                                   cluster_idx + 1)
-        compass_recording.compress_and_record_size(cluster_file, cluster_file, label, zipfile.ZIP_BZIP2, out_file,
-                                                   cluster_idx + 1)
-        compass_recording.compress_and_record_size(cluster_file, cluster_file, label, zipfile.ZIP_LZMA, out_file,
-                                                   cluster_idx + 1)
+        recorder.record_frame(df_tmp, columns, cluster_name, label, out_file, cluster_idx + 1)
+
+
+def split_columns_per_entropy_cluster(in_file, en_file, out_file, label, n_clusters, recorder=None, df_tmp=None,
+                                      scaled_entropy=None, grouping=None, silhouette=None):
+    """ Analyze input file, write output file; en_file is read when scaled_entropy is not given """
+    if df_tmp is None:
+        df_tmp = load_table(in_file)
+
+    clusters = reuse_clusters(grouping, label, n_clusters)
+    if clusters is None:
+        if scaled_entropy is None:
+            # Read entropy for each column
+            scaled_entropy = scale_entropies(en_file)
+        clusters = cluster_entropies(scaled_entropy, n_clusters, label, grouping, silhouette)
+    write_clusters(df_tmp, clusters, in_file, out_file, label, recorder)
+    return clusters
 
 
-def split_columns_per_cluster(in_file, out_file, label, n_clusters, tmp_dir):
+def split_columns_per_cluster(in_file, out_file, label, n_clusters, recorder=None,
+                              df_tmp=None, processed=None, grouping=None, silhouette=None):
     """ Analyze input file, write output file """
-    df_tmp = pd.read_csv(in_file)
-    clusters = preprocess_and_cluster(df_tmp, n_clusters, label)
+    if df_tmp is None:
+        df_tmp = load_table(in_file)
+
+    clusters = reuse_clusters(grouping, label, n_clusters)
+    if clusters is None and processed is None:
+        clusters = preprocess_and_cluster(df_tmp, n_clusters, label, grouping)
+    elif clusters is None:
+        clusters = cluster_features(processed, n_clusters, label, grouping, silhouette)
+    write_clusters(df_tmp, clusters, in_file, out_file, label, recorder)
+    return clusters
 
-    # Group column names by cluster
-    cluster_groups = {}
-    for cluster_idx, col_name in zip(clusters, df_tmp.columns):
-        if cluster_idx not in cluster_groups:
-            cluster_groups[cluster_idx] = [col_name]
-        else:
-            cluster_groups[cluster_idx].append(col_name)
 
-    # Write data for each cluster to a single CSV file
-    for cluster_idx, columns in cluster_groups.items():
-        cluster_df = df_tmp[columns]
-        cluster_file = f"{tmp_dir}/{os.path.basename(in_file).replace('.csv', '')}_{label}_cluster_{cluster_idx + 1}.csv"
-        cluster_df.to_csv(cluster_file, index=False, header=True)
-        # Compress and record size for each compression method
-        compass_recording.compress_and_record_size(cluster_file, cluster_file, label, zipfile.ZIP_DEFLATED, out_file,
-                                                   cluster_idx + 1)
-        compass_recording.compress_and_record_size(cluster_file, cluster_file, label, zipfile.ZIP_BZIP2, out_file,
-                                                   cluster_idx + 1)
-        compass_recording.compress_and_record_size(cluster_file, cluster_file, label, zipfile.ZIP_LZMA, out_file,
-                                                   cluster_idx + 1)
+def split_columns_per_compression_search(in_file, out_file, label, n_clusters, recorder=None, df_tmp=None,
+                                         scorer=None, method=compass_grouping.AGGLOMERATIVE):
+    """
+    Group the columns by searching for the smallest estimated compression cost, write output file
+    scorer : compass_grouping.SubsetScorer of the table, shared by the calls of a sweep so no subset is scored twice
+    """
+    if df_tmp is None:
+        df_tmp = load_table(in_file)
+    if scorer is None:
+        scorer = compass_grouping.SubsetScorer(df_tmp)
 
+    with compass_telemetry.stage("search", label=label, k=n_clusters, method=method) as fields:
+        clusters = compass_grouping.search(scorer, n_clusters, method)
+        fields["subsets_scored"] = len(scorer.scores)
+    groups = [[col for col, cluster in zip(scorer.columns, clusters) if cluster == idx] for idx in set(clusters)]
+    print(f"{label}: n_clusters = {n_clusters}, the estimated {scorer.objective}, {scorer.cost(groups)}, "
+          f"{len(scorer.scores)} subsets scored")
+    write_clusters(df_tmp, clusters, in_file, out_file, label, recorder)
 
-def get_entorpy_columns(en_file, entropy):
+
+def get_entorpy_columns(en_file, entropy=SIBACO_THRESHOLD):
     edf = pd.read_csv(en_file, sep=',', header=0)
     return edf.columns[(edf < entropy).all()].tolist()
 
 
-if __name__ == '__main__':
-    if len(sys.argv) != 5:
-        usage()
-
-    input_file = sys.argv[1]
-    entropy_file = sys.argv[2]
-    output_file = sys.argv[3]  # results
-    num_clusters = int(sys.argv[4])  # Convert string to integer
+def parse_k_range(k_range):
+    """ Parse an inclusive 'first:last' cluster range, raising ValueError if it is malformed or empty """
+    try:
+        first, last = (int(k) for k in k_range.split(':'))
+    except ValueError:
+        raise ValueError(f"--k-range must be first:last, e.g. 2:12, not '{k_range}'") from None
+    if not 1 <= first <= last:
+        raise ValueError(f"--k-range {k_range} is empty or starts below 1")
+    return range(first, last + 1)
+
+
+def incremental_grouping(state, drift_threshold):
+    """ Clusters of the previous run while no column entropy drifted more than drift_threshold, else a new grouping """
+    previous = state["grouping"]
+    drift = compass_entropy.entropy_drift(previous and previous["entropies"], state["entropies"])
+    if drift <= drift_threshold:
+        print(f"Entropy drift {drift} <= {drift_threshold}, keeping the column grouping")
+        return previous["clusters"]
+    print(f"Entropy drift {drift} > {drift_threshold}, clustering again")
+    state["grouping"] = {"entropies": state["entropies"], "clusters": {}}
+    return state["grouping"]["clusters"]
+
+
+def confirm_layouts(profile, profile_file, deferred, confirm_top=None):
+    """ Save the layouts of a sweep in its profile and compress the confirm_top best estimated ones, or all of them """
+    profile["layouts"].update(deferred.layouts)
+    compass_profile.save(profile, profile_file)
+    ranked = compass_profile.rank(profile, deferred.layouts)
+    for label, totals, codecs in ranked:
+        print(f"{label}: estimated {int(totals['size'])} bytes with {';'.join(codecs)}")
+    chosen = [label for label, _, _ in ranked[:confirm_top]] if confirm_top is not None else list(deferred.calls)
+    print(f"Compressing {len(chosen)} of {len(ranked)} layouts: {', '.join(chosen)}")
+    deferred.confirm(chosen)
+
+
+def run_sweep(in_file, en_file, out_file, k_values, recorder=None, entropy_options=None, cache_dir=None,
+              cache_max_bytes=compass_cache.DEFAULT_MAX_BYTES, drift_threshold=None, cluster_mode=FULL,
+              sample_size=DEFAULT_SAMPLE_ROWS, agreement=False, silhouette_sample=None, search=None,
+              search_options=None, partition_key=None, sibaco_threshold=SIBACO_THRESHOLD, profile_file=None,
+              confirm_top=None, checkpoint=None):
+    """
+    Load and preprocess the table once, then run every strategy for each number of clusters
+    entropy_options : keyword arguments of compass_entropy.analyze, by default the entropy of the loaded table
+    drift_threshold : update the entropy incrementally and keep the previous clusters until an entropy drifts more
+    cluster_mode, sample_size : column features of KMEANS_DATA, see column_features
+    agreement : also cluster the full data and report the agreement of the cluster_mode clusters with it
+    silhouette_sample : score the silhouette on this many sampled columns instead of all of them
+    search, search_options : also run the compass_grouping search method, scoring subsets with a SubsetScorer
+    created with search_options
+    partition_key : also record the hybrid layout of the entropy clusters split by every value of this column, and
+    with the SIBACO split its full-table baseline
+    sibaco_threshold : entropy below which SIBACO puts a column in its low-entropy group
+    profile_file : compressibility profile of the table, built on a sample if missing, where the layouts are saved
+    confirm_top : with a profile, compress only the confirm_top layouts with the smallest estimated size
+    checkpoint : called with every number of clusters once all its rows are recorded, except with a profile
+    """
+    df_in = load_table(in_file, cache_dir, cache_max_bytes)
+    # Every cluster holds at least one column, checked before any row is written
+    skipped = [k for k in k_values if k > len(df_in.columns)]
+    if skipped:
+        print(f"{in_file} has {len(df_in.columns)} columns, skipping cluster counts {min(skipped)} to {max(skipped)}")
+        k_values = [k for k in k_values if k <= len(df_in.columns)]
+
+    print("Analysing {} and writing {}".format(in_file, en_file))
+    state = None
+    grouping = None
+    if drift_threshold is not None:
+        chunksize = (entropy_options or {}).get("chunksize") or compass_entropy.DEFAULT_CHUNKSIZE
+        state = compass_entropy.analyze_incremental(in_file, en_file, chunksize)
+        grouping = incremental_grouping(state, drift_threshold)
+    elif entropy_options:
+        compass_entropy.analyze(in_file, en_file, threshold=sibaco_threshold, **entropy_options)
+    else:
+        compass_entropy.analyze_frame(df_in, en_file)
+
+    use_columns = get_entorpy_columns(en_file, sibaco_threshold)
+    if recorder is not None and recorder.encode:
+        recorder.entropies = compass_entropy.read_entropies(en_file)
+        recorder.threshold = sibaco_threshold
+    profile = None
+    if profile_file:
+        if recorder is None:
+            recorder = compass_recording.ResultRecorder()
+        profile = compass_profile.load_or_build(in_file, profile_file, df_in, recorder.codecs)
+        profile["entropies"] = compass_entropy.read_entropies(en_file)
+        # Layouts are estimated after the sweep, only the chosen ones are compressed
+        recorder = compass_profile.DeferredRecorder(recorder)
+    processed = None
+    full_processed = None
+    scaled_entropy = scale_entropies(en_file)
+    # Pairwise distances are computed once and reused for every number of clusters
+    data_silhouette = None
+    entropy_silhouette = compass_silhouette.Silhouette(scaled_entropy, silhouette_sample)
+    # Subset costs are cached across cluster counts
+    scorer = None
+    # Rows are grouped by the partition key once for every number of clusters
+    partitions = row_partitions(df_in, find_column(df_in, partition_key)) if partition_key else None
+
+    for n_clusters in k_values:
+        print(f"Running program for cluster size {n_clusters}...")
+        data_label = f"COMPASS_KMEANS_DATA ({n_clusters})"
+        if processed is None and len(df_in) > 0 and (grouping is None or data_label not in grouping):
+            processed = column_features(df_in, cluster_mode, sample_size)
+            data_silhouette = compass_silhouette.Silhouette(processed, silhouette_sample)
+        if n_clusters == 2:
+            split_columns(in_file, use_columns, out_file, "COMPASS_SIBACO", n_clusters, recorder, df_in)
+        data_clusters = split_columns_per_cluster(in_file, out_file, data_label, n_clusters, recorder, df_in,
+                                                  processed, grouping, data_silhouette)
+        if agreement and cluster_mode != FULL and len(df_in) > 0:
+            if full_processed is None:
+                full_processed = preprocess(df_in)
+            report_agreement(data_clusters, full_processed, n_clusters, data_label)
+        entropy_clusters = split_columns_per_entropy_cluster(
+            in_file, en_file, out_file, f"COMPASS_KMEANS_ENTROPY ({n_clusters})", n_clusters, recorder, df_in,
+            scaled_entropy, grouping, entropy_silhouette)
+        if partition_key:
+            if n_clusters == 2:
+                split_all(in_file, out_file, "COMPASS_HYBRID_FULL (1)", partition_key, recorder, df_in, partitions)
+            split_rows_and_columns(in_file, out_file, f"COMPASS_HYBRID_ENTROPY ({n_clusters})", partition_key,
+                                   entropy_clusters, recorder, df_in, partitions)
+        if search and len(df_in.columns) > 0:
+            if scorer is None:
+                scorer = compass_grouping.SubsetScorer(df_in, **(search_options or {}))
+            split_columns_per_compression_search(in_file, out_file, f"COMPASS_SEARCH_{search.upper()} ({n_clusters})",
+                                                 n_clusters, recorder, df_in, scorer, search)
+        if checkpoint is not None and profile is None:
+            if recorder is not None:
+                recorder.flush()
+            checkpoint(n_clusters)
+
+    if profile is not None:
+        confirm_layouts(profile, profile_file, recorder, confirm_top)
+    if state is not None:
+        compass_entropy.save_state(en_file, state)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        usage="compass_main.py <input_file.csv or directory> entropy_file.csv results.csv <num of clusters>")
+    parser.add_argument('input_file', help='Input CSV file or directory of CSV files')
+    parser.add_argument('entropy_file', help='Entropy CSV file to write')
+    parser.add_argument('output_file', help='Results CSV file')
+    parser.add_argument('num_clusters', type=int, nargs='?', help='Number of clusters')
+    parser.add_argument('--k-range', help='Sweep an inclusive range of cluster counts, e.g. 2:12, in one process')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of processes measuring compression in parallel')
+    parser.add_argument('--entropy-backend', choices=[compass_entropy.PANDAS, compass_entropy.NATIVE],
+                        default=compass_entropy.PANDAS, help='Compute entropy with pandas or the compiled calculator')
+    parser.add_argument('--entropy-chunksize', type=int,
+                        help='Compute entropy by streaming the input in chunks of this many rows')
+    parser.add_argument('--entropy-epsilon', type=float,
+                        help='Estimate high-cardinality column entropies with a sketch of this standard error (nats)')
+    parser.add_argument('--entropy-exact-limit', type=int, default=compass_entropy.EXACT_LIMIT,
+                        help='Distinct values per column counted exactly before switching to the sketch')
+    parser.add_argument('--cluster-mode', choices=[FULL, SAMPLE, PROFILE], default=FULL,
+                        help='Cluster columns on all rows, on a row sample or on per-column profiles of a sample')
+    parser.add_argument('--cluster-sample-rows', type=int, default=DEFAULT_SAMPLE_ROWS,
+                        help='Rows sampled by the sample and profile cluster modes')
+    parser.add_argument('--cluster-agreement', action='store_true',
+                        help='Report the adjusted Rand index between the sampled and the full-data clustering')
+    parser.add_argument('--silhouette-sample', type=int,
+                        help='Estimate the silhouette score on a random sample of this many columns')
+    parser.add_argument('--search', choices=[compass_grouping.AGGLOMERATIVE, compass_grouping.GREEDY],
+                        help='Also group columns by searching for the smallest sampled compression cost')
+    parser.add_argument('--search-objective', choices=[compass_grouping.SIZE, compass_grouping.DECOMPRESS],
+                        default=compass_grouping.SIZE, help='Cost minimized by --search, measured with the first codec')
+    parser.add_argument('--search-sample-rows', type=int, default=compass_grouping.DEFAULT_SAMPLE_ROWS,
+                        help='Rows sampled to score column subsets in --search')
+    parser.add_argument('--partition-key', metavar='COLUMN',
+                        help='Also split the rows of every entropy cluster by the values of COLUMN (hybrid layout)')
+    parser.add_argument('--encode', action='store_true',
+                        help='Pre-encode partition columns (dictionary, delta, run-length) before compressing them')
+    parser.add_argument('--sibaco-threshold', type=float, default=SIBACO_THRESHOLD,
+                        help='Entropy below which SIBACO puts a column in its low-entropy group')
+    parser.add_argument('--compressibility-profile', metavar='FILE', dest='profile_file',
+                        help='Compressibility profile of the table, built on a sample if missing; the layouts of the '
+                             'sweep are saved in it for compass_clean_results')
+    parser.add_argument('--confirm-top', type=int, metavar='N',
+                        help='With a profile, compress only the N layouts with the smallest estimated size')
+    parser.add_argument('--telemetry', metavar='FILE',
+                        help='Append per-stage wall/CPU time, peak memory and I/O bytes to FILE as JSON lines')
+    parser.add_argument('--profile-stage', help='Profile every occurrence of this telemetry stage, e.g. kmeans')
+    parser.add_argument('--profile-mode', choices=[compass_telemetry.CPROFILE, compass_telemetry.TRACEMALLOC],
+                        default=compass_telemetry.CPROFILE, help='Profiler of --profile-stage')
+    parser.add_argument('--incremental', type=float, metavar='DRIFT', dest='drift_threshold',
+                        help='Update entropy from rows appended since the last run and keep its column grouping '
+                             'until a column entropy drifts more than DRIFT')
+    parser.add_argument('--cache-dir', help='Columnar cache directory, so the CSV input is parsed only once')
+    parser.add_argument('--cache-max-bytes', type=int, default=compass_cache.DEFAULT_MAX_BYTES,
+                        help='Evict least recently used cache entries above this total size')
+    parser.add_argument('--codecs', nargs='+', default=compass_codecs.DEFAULT_SPECS, metavar='CODEC[:LEVEL[-LEVEL]]',
+                        help=f"Codecs to measure, available: {', '.join(compass_codecs.CODECS)}")
+    parser.add_argument('--zip-container', action='store_true',
+                        help='Measure zip files on disk instead of in-memory compression streams')
+    parser.add_argument('--default-dtypes', action='store_true',
+                        help='Load the input with the pandas default dtypes instead of compact dtypes')
+    args = parser.parse_args(argv)
+    if args.num_clusters is None and args.k_range is None:
+        parser.error("either <num of clusters> or --k-range is required")
+    if args.num_clusters is not None and args.num_clusters < 1:
+        parser.error("<num of clusters> must be at least 1")
+    if args.k_range:
+        try:
+            args.k_range = parse_k_range(args.k_range)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.entropy_backend == compass_entropy.NATIVE and (args.entropy_chunksize or args.entropy_epsilon):
+        parser.error("--entropy-chunksize and --entropy-epsilon only apply to the pandas entropy backend")
+    try:
+        args.codecs = compass_codecs.parse_specs(args.codecs)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.zip_container and any(compass_codecs.CODECS[name].zip_type is None for name, _ in args.codecs):
+        parser.error("--zip-container only supports the gzip, bzip2 and lzma codecs")
+    if args.drift_threshold is not None and (args.entropy_backend == compass_entropy.NATIVE or args.entropy_epsilon):
+        parser.error("--incremental keeps exact pandas counts and cannot be combined with the native or sketch entropy")
+    if args.profile_stage and not args.telemetry:
+        parser.error("--profile-stage needs --telemetry")
+    if args.confirm_top is not None and not args.profile_file:
+        parser.error("--confirm-top needs --compressibility-profile")
+    return args
+
+
+def main(argv=None):
+    """ Run compass_main.py with the command line arguments argv, sys.argv[1:] by default """
+    args = parse_arguments(argv)
+    if args.telemetry:
+        compass_telemetry.configure(args.telemetry, args.profile_stage, args.profile_mode)
+    if args.default_dtypes:
+        compass_ingest.configure(False)
+
+    input_file = args.input_file
+    entropy_file = args.entropy_file
+    output_file = args.output_file  # results
+    container = compass_recording.ZIP if args.zip_container else compass_recording.MEMORY
     print("Splitting {}".format(input_file))
 
-    temp_dir = tempfile.mkdtemp()  # Create temporary directory
+    k_values = args.k_range or [args.num_clusters]
+    entropy_options = {}
+    if args.entropy_backend != compass_entropy.PANDAS or args.entropy_chunksize or args.entropy_epsilon:
+        entropy_options = dict(chunksize=args.entropy_chunksize, epsilon=args.entropy_epsilon,
+                               exact_limit=args.entropy_exact_limit, backend=args.entropy_backend)
 
-    print("Analysing {} and writing {}".format(input_file, entropy_file))
-    compass_entropy.analyze(input_file, entropy_file)
+    with compass_recording.ResultRecorder(args.jobs, container, args.codecs, args.encode) as recorder:
+        run_sweep(input_file, entropy_file, output_file, k_values, recorder, entropy_options,
+                  args.cache_dir, args.cache_max_bytes, args.drift_threshold, args.cluster_mode,
+                  args.cluster_sample_rows, args.cluster_agreement, args.silhouette_sample, args.search,
+                  dict(codec=args.codecs[0], objective=args.search_objective, sample_rows=args.search_sample_rows),
+                  args.partition_key, args.sibaco_threshold, args.profile_file, args.confirm_top)
 
-    use_columns = get_entorpy_columns(entropy_file, 3)
-    if num_clusters == 2:
-        split_columns(input_file, use_columns, output_file, "COMPASS_SIBACO", num_clusters, temp_dir)
-    split_columns_per_cluster(input_file, output_file, f"COMPASS_KMEANS_DATA ({num_clusters})", num_clusters, temp_dir)
-    split_columns_per_entropy_cluster(input_file, output_file, f"COMPASS_KMEANS_ENTROPY ({num_clusters})", num_clusters,
-                                      temp_dir)
+
+if __name__ == '__main__':
+    main()
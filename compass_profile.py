@@ -0,0 +1,228 @@
+"""
+compass_profile.py
+Purpose: Per-table compressibility profile, to estimate the compressed size and timings of any column layout without
+compressing it.
+
+The profile is built once on a row sample of the table: the whole sample, every column and every pair of columns are
+serialized like partitions and compressed with each codec, recording the bytes and the compression and decompression
+seconds. A group of columns is estimated as the sum of its columns less the average saving of each column with a
+partner of the group, corrected for the group size so that single columns, pairs and the whole sample are exact, and
+scaled from the sample to the rows of the table. The profile is saved as JSON together with the column entropies and
+the layouts of the runs that used it, so that compass_clean_results can rank other SIBACO thresholds and numbers of
+clusters at once, and only the best candidates are compressed for real.
+
+Usage: compass_profile.py input_file.csv profile.json [--codecs gzip bzip2 lzma] [--sample-rows 10000]
+"""
+
+import argparse
+import json
+import os
+from itertools import combinations
+
+import compass_cache
+import compass_codecs
+import compass_entropy
+import compass_recording
+import compass_telemetry
+
+DEFAULT_SAMPLE_ROWS = 10000
+# Estimated quantities, in the order they are measured
+METRICS = ("size", "compress_time", "decompress_time")
+
+
+def _measure(sample, columns, codec):
+    data = compass_recording.serialize_partition(sample, columns)
+    size, compress_time, decompress_time = compass_recording.measure_buffer(data, codec)
+    return [size, compress_time, decompress_time]
+
+
+def build(df, codecs, sample_rows=DEFAULT_SAMPLE_ROWS):
+    """ Profile of df: measures of the sample, of every column and of every pair of columns with every codec """
+    sample = df if len(df) <= sample_rows else df.sample(n=sample_rows, random_state=42).sort_index()
+    columns = list(df.columns)
+    profile = {"rows": len(df), "sample_rows": len(sample), "columns": columns, "codecs": {}, "entropies": {},
+               "layouts": {}}
+    for codec in codecs:
+        codec_label = compass_codecs.label(codec)
+        with compass_telemetry.stage("profile", codec=codec_label):
+            profile["codecs"][codec_label] = {
+                "full": _measure(sample, None, codec),
+                "columns": [_measure(sample, [col], codec) for col in columns],
+                # Pairs are serialized in table order, as write_clusters does
+                "pairs": {f"{i},{j}": _measure(sample, [columns[i], columns[j]], codec)
+                          for i, j in combinations(range(len(columns)), 2)},
+            }
+    return profile
+
+
+def save(profile, path):
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=1)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_or_build(in_file, path, df, codecs, sample_rows=DEFAULT_SAMPLE_ROWS):
+    """ Profile saved in path if it was built from the current content of in_file with codecs, else a new one """
+    source = compass_cache.cache_key(in_file)
+    if os.path.isfile(path):
+        profile = load(path)
+        if profile.get("source") == source and all(compass_codecs.label(codec) in profile["codecs"]
+                                                   for codec in codecs):
+            print(f"Reusing the compressibility profile {path}")
+            return profile
+    print(f"Profiling {in_file} on {min(len(df), sample_rows)} rows into {path}")
+    profile = build(df, codecs, sample_rows)
+    profile.update(source=source, table=os.path.abspath(in_file))
+    save(profile, path)
+    return profile
+
+
+def _pairwise_measures(codec_profile, indexes):
+    """ Sum of the columns less their average saving with a partner: [bytes, compress s, decompress s] """
+    singles = codec_profile["columns"]
+    pairs = codec_profile["pairs"]
+    measures = []
+    for metric in range(len(METRICS)):
+        total = sum(singles[i][metric] for i in indexes)
+        if len(indexes) > 1:
+            savings = sum(singles[i][metric] + singles[j][metric] - pairs[f"{i},{j}"][metric]
+                          for i, j in combinations(indexes, 2))
+            total -= savings / (len(indexes) - 1)
+        measures.append(total)
+    return measures
+
+
+def _group_measures(codec_profile, indexes):
+    """
+    Sample [bytes, compress s, decompress s] of the sorted column indexes of a group
+    Interleaving more columns in a row hides more of the patterns of each column than pairs show, so the pairwise
+    estimate is corrected in proportion to the group size, up to the correction that makes the whole table exact.
+    """
+    measures = _pairwise_measures(codec_profile, indexes)
+    n_columns = len(codec_profile["columns"])
+    if len(indexes) <= 2 or n_columns <= 2:
+        return measures
+    whole = _pairwise_measures(codec_profile, list(range(n_columns)))
+    weight = (len(indexes) - 2) / (n_columns - 2)
+    return [measure * (1 + (full / estimate - 1) * weight) if estimate > 0 else measure
+            for measure, full, estimate in zip(measures, codec_profile["full"], whole)]
+
+
+def estimate_group(profile, columns, codec_label):
+    """ Estimated size and seconds of one partition of columns of the whole table """
+    index = {col: idx for idx, col in enumerate(profile["columns"])}
+    scale = profile["rows"] / max(profile["sample_rows"], 1)
+    measures = _group_measures(profile["codecs"][codec_label], sorted(index[col] for col in columns))
+    return {metric: value * scale for metric, value in zip(METRICS, measures)}
+
+
+def estimate_baseline(profile, objective="size"):
+    """ Estimated measures of the full table with the best codec under objective, and that codec """
+    scale = profile["rows"] / max(profile["sample_rows"], 1)
+    options = {codec_label: {metric: value * scale for metric, value in zip(METRICS, codec_profile["full"])}
+               for codec_label, codec_profile in profile["codecs"].items()}
+    best = min(options, key=lambda codec_label: options[codec_label][objective])
+    return options[best], best
+
+
+def estimate_layout(profile, groups, objective="size"):
+    """ Estimated totals of a layout with the best codec of every group under objective, and the codec of each group """
+    totals = dict.fromkeys(METRICS, 0.0)
+    codecs = []
+    for group in groups:
+        if not group:
+            continue
+        options = {codec_label: estimate_group(profile, group, codec_label) for codec_label in profile["codecs"]}
+        best = min(options, key=lambda codec_label: options[codec_label][objective])
+        for metric in METRICS:
+            totals[metric] += options[best][metric]
+        codecs.append(best)
+    return totals, codecs
+
+
+def rank(profile, layouts, objective="size"):
+    """ (label, estimated totals, codecs) of every layout, best first under objective """
+    estimates = [(label, *estimate_layout(profile, groups, objective)) for label, groups in layouts.items()]
+    return sorted(estimates, key=lambda estimate: estimate[1][objective])
+
+
+def sibaco_layout(profile, threshold):
+    """ SIBACO groups of the profiled table: the columns with entropy below threshold, and the others """
+    low = [col for col in profile["columns"] if profile["entropies"][col] < threshold]
+    return [low, [col for col in profile["columns"] if col not in low]]
+
+
+def threshold_candidates(entropies):
+    """ One SIBACO threshold per distinct split of the columns: the midpoints between sorted distinct entropies """
+    values = sorted(set(entropies.values()))
+    return [round((low + high) / 2, 6) for low, high in zip(values, values[1:])]
+
+
+def confirm(profile, layouts, out_file):
+    """ Compress the layouts of the profiled table for real with the profiled codecs, appending rows to out_file """
+    df = compass_cache.read_csv(profile["table"])
+    codecs = [compass_codecs.parse_label(codec_label)[:2] for codec_label in profile["codecs"]]
+    table_name = os.path.basename(profile["table"]).replace('.csv', '')
+    with compass_recording.ResultRecorder(codecs=codecs) as recorder:
+        for label, groups in layouts.items():
+            for idx, columns in enumerate(group for group in groups if group):
+                recorder.record_frame(df, columns, f"{table_name}_{label}_cluster_{idx + 1}.csv", label, out_file,
+                                      idx + 1)
+
+
+class DeferredRecorder:
+    """
+    Collects the partitions recorded under every label instead of compressing them, until confirm replays the labels
+    chosen on the real recorder. The full-table baseline and row-partitioned cells, which a column profile cannot
+    estimate, are recorded at once.
+    """
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.encode = recorder.encode
+        self.calls = {}
+
+    def record_frame(self, df, columns, name, label, out_file='results.csv', cluster_id=0, compressions=None):
+        if name.endswith("_full.csv") or isinstance(cluster_id, str):
+            self.recorder.record_frame(df, columns, name, label, out_file, cluster_id, compressions)
+            return
+        self.calls.setdefault(label, []).append((df, columns, name, label, out_file, cluster_id, compressions))
+
+    @property
+    def layouts(self):
+        """ Column groups recorded under every label, in recording order """
+        return {label: [list(call[0].columns if call[1] is None else call[1]) for call in calls]
+                for label, calls in self.calls.items()}
+
+    def confirm(self, labels):
+        """ Record the partitions of labels for real """
+        for label in labels:
+            for call in self.calls[label]:
+                self.recorder.record_frame(*call)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the compressibility profile of a table.')
+    parser.add_argument('input_file', help='Input CSV file or directory of CSV files')
+    parser.add_argument('profile_file', help='Profile JSON to write')
+    parser.add_argument('--codecs', nargs='+', default=compass_codecs.DEFAULT_SPECS, metavar='CODEC[:LEVEL[-LEVEL]]',
+                        help=f"Codecs to profile, available: {', '.join(compass_codecs.CODECS)}")
+    parser.add_argument('--sample-rows', type=int, default=DEFAULT_SAMPLE_ROWS, help='Rows of the profiled sample')
+    args = parser.parse_args()
+    try:
+        codecs = compass_codecs.parse_specs(args.codecs)
+    except ValueError as e:
+        parser.error(str(e))
+    df = compass_cache.read_csv(args.input_file)
+    profile = load_or_build(args.input_file, args.profile_file, df, codecs, args.sample_rows)
+    if not profile["entropies"]:
+        profile["entropies"] = {col: float(compass_entropy.shannon_entropy(df[col])) for col in df}
+        save(profile, args.profile_file)
+
+
+if __name__ == "__main__":
+    main()
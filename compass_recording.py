@@ -1,23 +1,72 @@
+import io
 import os
 import zipfile
 import time
 import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
+import compass_codecs
+import compass_encoding
+import compass_entropy
+import compass_telemetry
 
-def compress_and_record_size(inp_file_name, out_zip_file, label, compression=zipfile.ZIP_BZIP2, out_file='results.csv',
-                             cluster_id=0):
+MEMORY = "memory"
+ZIP = "zip"
+# Label prefix of the results rows of pre-encoded partitions
+ENCODED_PREFIX = "ENCODED_"
+# Partitions queued in the pool per worker before record_frame waits for the oldest one
+MAX_PENDING_PER_JOB = 2
+
+
+def codec_level(compression):
+    """ (codec name, level) of a zipfile compression constant, or of an already parsed codec spec """
+    if isinstance(compression, tuple):
+        return compression
+    name = compass_codecs.ZIP_CODECS[compression]
+    return name, compass_codecs.CODECS[name].default_level
+
+
+def write_result(out_file, cluster_id, name, label, extension, size, compress_time, decompress_time, jobs=1):
+    """ Append one row to the results file, tagging rows measured alongside other workers with the pool size """
+    concurrency = f",{jobs},jobs" if jobs > 1 else ""
+    with open(out_file, "a") as f:
+        f.write(f"{cluster_id},{name},{label},{extension},{size},bytes,{compress_time},s,{decompress_time},s"
+                f"{concurrency}\n")
+
+
+def measure_buffer(data, compression=zipfile.ZIP_BZIP2):
     """
-    function : file_compress
-    args : inp_file_names : list of filenames to be zipped
-    out_zip_file : output zip file
-    return : none
-    assumption : Input file paths and this code is in same directory.
+    Compress and decompress an in-memory buffer
+    compression : zipfile constant or (codec name, level) from compass_codecs
+    return : (compressed size, compression seconds, decompression seconds)
     """
+    name, level = codec_level(compression)
+    codec = compass_codecs.CODECS[name]
+
+    start_compress_time = time.perf_counter()
+    compressed = codec.compress(data, level)
+    compress_time = time.perf_counter() - start_compress_time
 
-    print(f" *** Input File name passed for zipping - {inp_file_name}")
+    start_decompress_time = time.perf_counter()
+    codec.decompress(compressed)
+    decompress_time = time.perf_counter() - start_decompress_time
 
-    zip_extension = {zipfile.ZIP_DEFLATED: ".gzip.zip", zipfile.ZIP_BZIP2: ".bzip2.zip", zipfile.ZIP_LZMA: ".lzma.zip"}
-    out_zip_file = out_zip_file + zip_extension[compression]
+    return len(compressed), compress_time, decompress_time
+
+
+def measure_zip(data, out_zip_file, compression=zipfile.ZIP_BZIP2):
+    """
+    Zip container round trip through the file system of the bytes in data
+    return : (zip file size, compression seconds, decompression seconds)
+    """
+    name, level = codec_level(compression)
+    codec = compass_codecs.CODECS[name]
+    if codec.zip_type is None:
+        raise ValueError(f"{name} has no zip container method")
+    # The zipfile default is used at the default level, so the zip files match earlier results byte for byte
+    compresslevel = None if level == codec.default_level else level
+    out_zip_file = out_zip_file + compass_codecs.label((name, level), zip_container=True)
     # create the zip file first parameter path/name, second mode
     print(f' *** out_zip_file is - {out_zip_file}')
     zf = zipfile.ZipFile(out_zip_file, mode="w")
@@ -25,9 +74,10 @@ def compress_and_record_size(inp_file_name, out_zip_file, label, compression=zip
     start_compress_time = time.time()  # Start time for compression
     try:
         # Add file to the zip file
-        # first parameter file to zip, second filename in zip
-        print(f' *** {label}: Processing file {inp_file_name}')
-        zf.write(inp_file_name, out_zip_file, compress_type=compression)
+        # first parameter file to zip, second filename in zip: the zip file path without its root, as zf.write
+        # stored it when the split files were written to a temporary directory, so the container size is the same
+        arcname = os.path.normpath(os.path.splitdrive(out_zip_file)[1]).lstrip(os.sep)
+        zf.writestr(arcname, data, compress_type=codec.zip_type, compresslevel=compresslevel)
     except FileNotFoundError as e:
         print(f' *** Exception occurred during zip process - {e}')
     finally:
@@ -38,11 +88,111 @@ def compress_and_record_size(inp_file_name, out_zip_file, label, compression=zip
     size = os.path.getsize(out_zip_file)
 
     # Measure decompression time
-    start_decompress_time = time.time()
-    with zipfile.ZipFile(out_zip_file, 'r') as zip_ref:
-        zip_ref.extractall(tempfile.mkdtemp())
-    decompress_time = time.time() - start_decompress_time
+    with tempfile.TemporaryDirectory() as extract_dir:
+        start_decompress_time = time.time()
+        with zipfile.ZipFile(out_zip_file, 'r') as zip_ref:
+            zip_ref.extractall(extract_dir)
+        decompress_time = time.time() - start_decompress_time
 
-    with open(out_file, "a") as f:
-        f.write(f"{cluster_id},{os.path.basename(inp_file_name)},{label},{zip_extension[compression]},{size},bytes,{compress_time},s,{decompress_time},s\n")
     os.remove(out_zip_file)
+    return size, compress_time, decompress_time
+
+
+def measure_data(data, name, compression=zipfile.ZIP_BZIP2, container=MEMORY):
+    """
+    Measure serialized partition bytes with one compression method
+    return : (extension, size, compression seconds, decompression seconds)
+    """
+    zip_container = container == ZIP
+    extension = compass_codecs.label(codec_level(compression), zip_container)
+    with compass_telemetry.stage("compress", partition=name, codec=extension, input_bytes=len(data)):
+        if zip_container:
+            with tempfile.TemporaryDirectory() as scratch_dir:
+                out_zip_file = os.path.join(scratch_dir, name)
+                return (extension,) + measure_zip(data, out_zip_file, compression)
+        return (extension,) + measure_buffer(data, compression)
+
+
+def measure_partition(data, name, compressions, container=MEMORY):
+    """ measure_data of one partition with every compression method, as a single task of the pool """
+    return [measure_data(data, name, compression, container) for compression in compressions]
+
+
+def serialize_partition(df, columns=None):
+    """ CSV bytes of a column projection of df, exactly as the split files were written """
+    buffer = io.BytesIO()
+    df.to_csv(buffer, index=False, columns=columns, header=True)
+    return buffer.getvalue()
+
+
+class ResultRecorder:
+    """
+    Runs the compression measurements, serially or in a process pool
+    Rows are always written by this process in submission order, so results.csv is the same for any number of jobs.
+    Each partition is one task measuring every codec, timed inside its worker; rows measured in a pool carry the pool
+    size as an extra column. At most MAX_PENDING_PER_JOB partitions per worker are held waiting for their results.
+    """
+
+    def __init__(self, jobs=1, container=MEMORY, codecs=None, encode=False):
+        self.jobs = jobs
+        self.container = container
+        # (codec name, level) pairs measured by record_frame
+        self.codecs = codecs or compass_codecs.parse_specs(compass_codecs.DEFAULT_SPECS)
+        # Pre-encode partitions with compass_encoding, choosing encodings with these column entropies if set and
+        # dictionary encoding the columns below the SIBACO threshold of the run
+        self.encode = encode
+        self.entropies = None
+        self.threshold = compass_entropy.SIBACO_THRESHOLD
+        self.pending = deque()
+        self.executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record_frame(self, df, columns, name, label, out_file='results.csv', cluster_id=0, compressions=None):
+        """ Serialize a column projection of df once and record it with every codec of the recorder """
+        with compass_telemetry.stage("serialize", partition=name, label=label) as fields:
+            data = serialize_partition(df, columns)
+            fields["output_bytes"] = len(data)
+        print(f" *** {label}: Serialized {name} to {len(data)} bytes")
+        if self.encode:
+            with compass_telemetry.stage("encode", partition=name, label=label) as fields:
+                data, encodings = compass_encoding.encode_partition(df, columns, data, self.entropies, self.threshold)
+                fields["output_bytes"] = len(data)
+            print(f" *** {label}: Encoded {name} to {len(data)} bytes with {encodings}")
+            # Every partition of an encoded run is labelled, so a layout never mixes encoded and plain rows
+            label = ENCODED_PREFIX + label
+        compressions = compressions or self.codecs
+        if self.executor is None:
+            for extension, size, compress_time, decompress_time in measure_partition(data, name, compressions,
+                                                                                     self.container):
+                write_result(out_file, cluster_id, name, label, extension, size, compress_time, decompress_time)
+            return
+        future = self.executor.submit(measure_partition, data, name, compressions, self.container)
+        self.pending.append((future, out_file, cluster_id, name, label))
+        self._write_finished()
+
+    def _write_finished(self, wait=False):
+        """
+        Write rows of finished measurements, stopping at the first one still running to keep the order, after
+        waiting for the oldest ones while more than MAX_PENDING_PER_JOB partitions per worker are pending
+        """
+        max_pending = MAX_PENDING_PER_JOB * self.jobs
+        while self.pending and (wait or self.pending[0][0].done() or len(self.pending) > max_pending):
+            future, out_file, cluster_id, name, label = self.pending.popleft()
+            for extension, size, compress_time, decompress_time in future.result():
+                write_result(out_file, cluster_id, name, label, extension, size, compress_time, decompress_time,
+                             self.jobs)
+
+    def flush(self):
+        """ Wait for the pending measurements and write their rows """
+        self._write_finished(wait=True)
+
+    def close(self):
+        """ Wait for all measurements and write the remaining rows """
+        self.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
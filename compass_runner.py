@@ -0,0 +1,247 @@
+"""
+compass_runner.py
+Purpose: Resumable COMPASS experiments over a directory of tables, replacing the serial run_compass_for_all.sh loop.
+
+Every table is one job running compass_main.run_sweep over its unfinished numbers of clusters in a worker process,
+largest tables first, so a table is loaded, its entropy computed and its columns preprocessed once per run, and no two
+workers hold the same table. The rows of every number of clusters are published atomically as soon as it is finished,
+and the worker then records its (table, strategy, k, codec) tasks in the manifest: an interrupted run, even a killed
+one, started again skips the published numbers of clusters and reruns the others from scratch, without duplicating
+rows. Once all of them are
+finished, the runner writes the same files as run_compass_experiments.sh: results_<table>.csv, compass_<table>.log
+and entropy_<table>_file.csv.
+
+Usage: compass_runner.py [envmondb] [--out-dir DIR] [--jobs N] [--k-range 2:N] [--codecs ...] [--force]
+"""
+
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import compass_codecs
+import compass_ingest
+import compass_main
+import compass_recording
+
+MANIFEST = "compass_manifest.json"
+
+
+def atomic_write(path, text):
+    """ Replace path with text in one rename, so readers and restarts never see a partial file """
+    tmp_file = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_file, "w") as f:
+        f.write(text)
+    os.replace(tmp_file, path)
+
+
+def task_key(table, strategy, n_clusters, codec):
+    return f"{table}|{strategy}|{n_clusters}|{codec}"
+
+
+def job_tasks(table, n_clusters, codecs):
+    """ Manifest keys of the results rows written by the job of table and n_clusters """
+    strategies = ["COMPASS_KMEANS_DATA", "COMPASS_KMEANS_ENTROPY"]
+    if n_clusters == 2:
+        strategies.insert(0, "COMPASS_SIBACO")
+    return [task_key(table, strategy, n_clusters, compass_codecs.label(codec)) for strategy in strategies
+            for codec in codecs]
+
+
+def load_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.isfile(path):
+        return {"tasks": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(out_dir, manifest):
+    atomic_write(os.path.join(out_dir, MANIFEST), json.dumps(manifest, indent=1))
+
+
+def mark_finished(manifest, table, k_values, codecs):
+    """ Record the tasks of the numbers of clusters k_values of table in manifest """
+    for n_clusters in k_values:
+        for key in job_tasks(table, n_clusters, codecs):
+            manifest["tasks"].setdefault(key, {"finished": time.time()})
+
+
+def update_manifest(out_dir, table, n_clusters, codecs, lock):
+    """ Record a published number of clusters in the manifest on disk, lock serializing the workers """
+    with lock:
+        manifest = load_manifest(out_dir)
+        mark_finished(manifest, table, [n_clusters], codecs)
+        save_manifest(out_dir, manifest)
+
+
+def job_dir(out_dir, table):
+    return os.path.join(out_dir, "jobs", table)
+
+
+def remove_scratch_dirs(out_dir):
+    """ Remove the scratch directories left by workers of a killed run """
+    for scratch in glob.glob(os.path.join(out_dir, "jobs", "*", "run.*")):
+        print(f"Removing {scratch} of an interrupted run")
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def run_job(in_file, table, k_values, out_dir, codecs, cache_dir, manifest_lock):
+    """
+    Run the numbers of clusters k_values on one table in a worker, publishing the rows of each one as it finishes
+    and the log of the run, even if it fails
+    manifest_lock : lock shared by the workers, held while a published number of clusters is added to the manifest
+    return : table
+    """
+    directory = job_dir(out_dir, table)
+    os.makedirs(directory, exist_ok=True)
+    # Logs of an earlier failed run of the same numbers of clusters, whose rows were never published
+    for n_clusters in k_values:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(directory, f"k{n_clusters}.log"))
+    scratch = os.path.join(directory, f"run.{os.getpid()}")
+    os.makedirs(scratch, exist_ok=True)
+    results_file = os.path.join(scratch, "results.csv")
+    entropy_file = os.path.join(scratch, "entropy.csv")
+    log_file = os.path.join(scratch, "compass.log")
+    published = 0
+
+    def checkpoint(n_clusters):
+        """ Publish the rows written since the previous number of clusters, the entropy file with the first one """
+        nonlocal published
+        with open(results_file) as f:
+            f.seek(published)
+            rows = f.read()
+            published = f.tell()
+        if n_clusters == k_values[0]:
+            shutil.copyfile(entropy_file, os.path.join(directory, "entropy.csv"))
+        # The log so far, kept if the run is killed before it ends
+        sys.stdout.flush()
+        shutil.copyfile(log_file, os.path.join(directory, f"k{k_values[0]}.log"))
+        # The rows are published last: a number of clusters counts as finished once they are in place
+        atomic_write(os.path.join(directory, f"k{n_clusters}.csv"), rows)
+        update_manifest(out_dir, table, n_clusters, codecs, manifest_lock)
+
+    try:
+        with open(log_file, "w") as log, contextlib.redirect_stdout(log):
+            with compass_recording.ResultRecorder(codecs=codecs) as recorder:
+                compass_main.run_sweep(in_file, entropy_file, results_file, k_values, recorder, cache_dir=cache_dir,
+                                       checkpoint=checkpoint)
+    finally:
+        os.replace(log_file, os.path.join(directory, f"k{k_values[0]}.log"))
+        shutil.rmtree(scratch, ignore_errors=True)
+    return table
+
+
+def finished_k_values(out_dir, table, k_values):
+    """ Numbers of clusters of a table whose rows are published """
+    return [k for k in k_values if os.path.isfile(os.path.join(job_dir(out_dir, table), f"k{k}.csv"))]
+
+
+def assemble(out_dir, table, k_values):
+    """ Write the results, log and entropy files of a finished table from its job files, in cluster order """
+    directory = job_dir(out_dir, table)
+    # A run logs all its numbers of clusters in the log of the first one
+    for target, suffix in ((f"results_{table}.csv", "csv"), (f"compass_{table}.log", "log")):
+        parts = []
+        for n_clusters in k_values:
+            path = os.path.join(directory, f"k{n_clusters}.{suffix}")
+            if os.path.isfile(path):
+                with open(path) as f:
+                    parts.append(f.read())
+        atomic_write(os.path.join(out_dir, target), "".join(parts))
+    shutil.copyfile(os.path.join(directory, "entropy.csv"), os.path.join(out_dir, f"entropy_{table}_file.csv"))
+    print(f"{table}: wrote results_{table}.csv")
+
+
+def table_k_values(in_file, k_range=None):
+    """ Cluster counts of a table: k_range, or 2, up to its number of columns like run_compass_for_all.sh """
+    num_columns = len(pd.read_csv(in_file, nrows=0).columns)
+    if k_range:
+        return [k for k in k_range if k <= num_columns]
+    return list(range(2, num_columns + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run COMPASS on every table of a directory, resuming finished work.')
+    parser.add_argument('input_dir', nargs='?', default='envmondb', help='Directory of CSV tables')
+    parser.add_argument('--out-dir', default='.', help='Directory of the results, logs and manifest')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--k-range', help='Cluster counts of every table, default 2 up to its number of columns')
+    parser.add_argument('--codecs', nargs='+', default=compass_codecs.DEFAULT_SPECS, metavar='CODEC[:LEVEL[-LEVEL]]',
+                        help=f"Codecs to measure, available: {', '.join(compass_codecs.CODECS)}")
+    parser.add_argument('--cache-dir', help='Columnar cache shared by the workers, default <out-dir>/cache')
+    parser.add_argument('--force', action='store_true',
+                        help='Discard the manifest and the published job files and run every job again')
+    parser.add_argument('--default-dtypes', action='store_true',
+                        help='Load the tables with the pandas default dtypes instead of compact dtypes')
+    args = parser.parse_args()
+    try:
+        codecs = compass_codecs.parse_specs(args.codecs)
+        k_range = compass_main.parse_k_range(args.k_range) if args.k_range else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.default_dtypes:
+        compass_ingest.configure(False)
+    os.makedirs(args.out_dir, exist_ok=True)
+    cache_dir = args.cache_dir or os.path.join(args.out_dir, "cache")
+    remove_scratch_dirs(args.out_dir)
+    if args.force:
+        manifest = {"tasks": {}}
+        shutil.rmtree(os.path.join(args.out_dir, "jobs"), ignore_errors=True)
+    else:
+        manifest = load_manifest(args.out_dir)
+
+    # Largest tables first, so the longest jobs do not start last
+    tables = sorted(glob.glob(os.path.join(args.input_dir, "*.csv")), key=os.path.getsize, reverse=True)
+    k_values = {os.path.basename(in_file)[:-len(".csv")]: table_k_values(in_file, k_range) for in_file in tables}
+    pending = {}
+    for in_file in tables:
+        table = os.path.basename(in_file)[:-len(".csv")]
+        # Published rows count as done even if the run was killed before recording them in the manifest
+        mark_finished(manifest, table, finished_k_values(args.out_dir, table, k_values[table]), codecs)
+        pending[table] = [k for k in k_values[table]
+                          if not all(key in manifest["tasks"] for key in job_tasks(table, k, codecs))]
+        print(f"{table}: {len(k_values[table]) - len(pending[table])} of {len(k_values[table])} cluster counts "
+              f"already done")
+    save_manifest(args.out_dir, manifest)
+
+    with multiprocessing.Manager() as sync, ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        manifest_lock = sync.Lock()
+        futures = {}
+        for in_file in tables:
+            table = os.path.basename(in_file)[:-len(".csv")]
+            if pending[table]:
+                futures[executor.submit(run_job, in_file, table, pending[table], args.out_dir, codecs,
+                                        cache_dir, manifest_lock)] = table
+        for future in as_completed(futures):
+            table = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                # The other tables go on, the unfinished numbers of clusters are run again by the next run
+                print(f"{table} failed: {e!r}")
+            # The worker recorded every number of clusters it published in the manifest
+            finished = finished_k_values(args.out_dir, table, pending[table])
+            pending[table] = [k for k in pending[table] if k not in finished]
+            print(f"{table}: {len(finished)} cluster counts done, {len(pending[table])} left")
+            if not pending[table]:
+                assemble(args.out_dir, table, k_values[table])
+
+    # Tables finished in earlier runs whose combined files are missing
+    for table, values in k_values.items():
+        if not pending[table] and not os.path.isfile(os.path.join(args.out_dir, f"results_{table}.csv")):
+            assemble(args.out_dir, table, values)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+compass_server.py
+Purpose: Resident COMPASS process, so that short compass_main.py jobs do not each pay for starting Python and
+importing pandas, scipy and sklearn.
+
+- serve: import compass_main and its heavy dependencies once, then accept jobs on a Unix socket. Every job runs in a
+  forked child of the server, in the working directory and with the COMPASS_* environment of the client, and its
+  output is streamed back over the connection.
+- run: thin client taking the compass_main.py arguments, for the run_compass_*.sh scripts. It imports nothing heavy,
+  prints the output of the job and exits with its status. Without a server it runs compass_main.py itself.
+- stop: stop the server; jobs already running finish.
+- bench: run the same job with compass_main.py and through a temporary server, and report the startup latency (until
+  the first line of output) and the total wall time of both. Every run appends its rows to the results file.
+
+The socket is COMPASS_SOCKET, by default compass-<uid>.sock in the temporary directory.
+
+Usage: compass_server.py serve | stop [--socket PATH]
+       compass_server.py run <compass_main.py arguments>
+       compass_server.py bench [--repeat 3] [--socket PATH] <compass_main.py arguments>
+"""
+
+import argparse
+import importlib
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_SOCKET = os.environ.get("COMPASS_SOCKET",
+                                os.path.join(tempfile.gettempdir(), f"compass-{os.getuid()}.sock"))
+# Imported by the server before it accepts jobs, including the ones compass_main imports on first use
+PRELOADED_MODULES = ["compass_main", "scipy.stats", "sklearn.cluster", "sklearn.compose", "sklearn.impute",
+                     "sklearn.metrics", "sklearn.pipeline", "sklearn.preprocessing"]
+# Modules reading COMPASS_* variables when they are imported, reloaded in every job for the client environment
+ENVIRONMENT_MODULES = ["compass_telemetry", "compass_ingest", "compass_cache"]
+# Sent after the output of a job, followed by its exit status
+EXIT_MARKER = b"\0compass-exit "
+STARTUP_TIMEOUT = 60
+COMPASS_MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "compass_main.py")
+
+
+def _read_request(conn):
+    """ JSON request line of a connection, None for a connection closed without one, such as a readiness probe """
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+def _call_main(argv):
+    """ Exit status of compass_main.main(argv), as the compass_main.py process would exit """
+    import compass_main
+    sys.argv = [COMPASS_MAIN] + argv
+    try:
+        compass_main.main(argv)
+    except SystemExit as e:
+        if isinstance(e.code, str):
+            print(e.code, file=sys.stderr)
+            return 1
+        return e.code or 0
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def _run_job(conn, request):
+    """ Run a job in the forked child of the server, with its output on conn, and exit """
+    status = 1
+    try:
+        # Jobs wait for their own subprocesses and process pools
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.chdir(request["cwd"])
+        for name in [name for name in os.environ if name.startswith("COMPASS_")]:
+            del os.environ[name]
+        os.environ.update(request["env"])
+        for name in ENVIRONMENT_MODULES:
+            importlib.reload(sys.modules[name])
+        for fd in (1, 2):
+            os.dup2(conn.fileno(), fd)
+        sys.stdout.reconfigure(line_buffering=True)
+        status = _call_main(request["argv"])
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        conn.sendall(EXIT_MARKER + str(status).encode())
+        os._exit(0)
+
+
+def _connect(path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def serve(path=DEFAULT_SOCKET):
+    """ Accept jobs on the Unix socket path until a stop request """
+    for name in PRELOADED_MODULES:
+        importlib.import_module(name)
+    if os.path.exists(path):
+        running = _connect(path)
+        if running is not None:
+            running.close()
+            sys.exit(f"A COMPASS server is already listening on {path}")
+        # Left behind by a server that did not stop cleanly
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen()
+    # Finished jobs are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    print(f"Serving COMPASS jobs on {path}", flush=True)
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                request = _read_request(conn)
+                if request is None:
+                    continue
+                if request.get("command") == "stop":
+                    break
+                # Nothing buffered before the fork may be written twice
+                sys.stdout.flush()
+                sys.stderr.flush()
+                if os.fork() == 0:
+                    server.close()
+                    _run_job(conn, request)
+    finally:
+        server.close()
+        os.unlink(path)
+    print("COMPASS server stopped")
+
+
+def run(argv, path=DEFAULT_SOCKET):
+    """ Run a compass_main.py job on the server, or in place of this process if no server is listening """
+    client = _connect(path)
+    if client is None:
+        os.execv(sys.executable, [sys.executable, COMPASS_MAIN] + argv)
+    request = {"argv": argv, "cwd": os.getcwd(),
+               "env": {name: value for name, value in os.environ.items() if name.startswith("COMPASS_")}}
+    out = sys.stdout.buffer
+    # The end of the output is held back until it cannot be part of the exit marker
+    hold = len(EXIT_MARKER) + 12
+    tail = b""
+    with client:
+        client.sendall(json.dumps(request).encode() + b"\n")
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            tail += chunk
+            if len(tail) > hold:
+                out.write(tail[:-hold])
+                out.flush()
+                tail = tail[-hold:]
+    marker = tail.rfind(EXIT_MARKER)
+    if marker < 0:
+        out.write(tail)
+        out.flush()
+        print(f"The COMPASS server on {path} closed the connection before the job finished", file=sys.stderr)
+        return 1
+    out.write(tail[:marker])
+    out.flush()
+    return int(tail[marker + len(EXIT_MARKER):])
+
+
+def stop(path=DEFAULT_SOCKET):
+    client = _connect(path)
+    if client is None:
+        print(f"No COMPASS server on {path}")
+        return
+    with client:
+        client.sendall(json.dumps({"command": "stop"}).encode() + b"\n")
+
+
+def timed_run(command, env):
+    """ (seconds until the first line of output, total seconds, exit status) of a command """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+    process.stdout.readline()
+    startup = time.perf_counter() - start
+    process.stdout.read()
+    status = process.wait()
+    return startup, time.perf_counter() - start, status
+
+
+def bench(argv, repeat=3, path=None):
+    """ Startup latency and wall time of a job run with compass_main.py and through a temporary server """
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        path = path or os.path.join(scratch_dir, "compass.sock")
+        env = dict(os.environ, COMPASS_SOCKET=path, PYTHONUNBUFFERED="1")
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", "--socket", path],
+                                  stdout=subprocess.DEVNULL, env=env)
+        try:
+            deadline = time.time() + STARTUP_TIMEOUT
+            while True:
+                probe = _connect(path)
+                if probe is not None:
+                    probe.close()
+                    break
+                if server.poll() is not None or time.time() > deadline:
+                    sys.exit("The COMPASS server did not start")
+                time.sleep(0.05)
+            modes = {"direct": [sys.executable, COMPASS_MAIN] + argv,
+                     "served": [sys.executable, os.path.abspath(__file__), "run"] + argv}
+            print("mode,run,startup_s,wall_s,status")
+            for mode, command in modes.items():
+                for idx in range(repeat):
+                    startup, wall, status = timed_run(command, env)
+                    print(f"{mode},{idx + 1},{startup:.4f},{wall:.4f},{status}")
+        finally:
+            stop(path)
+            server.wait()
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "run":
+        # The arguments are compass_main.py arguments, passed on unparsed
+        sys.exit(run(sys.argv[2:]))
+    parser = argparse.ArgumentParser(description='Resident COMPASS server and its client.')
+    parser.add_argument('command', choices=['serve', 'stop', 'bench'])
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket of the server')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each mode with bench')
+    args, job_args = parser.parse_known_args()
+    if args.command == 'bench':
+        bench(job_args, args.repeat, None if args.socket == DEFAULT_SOCKET else args.socket)
+    elif job_args:
+        parser.error(f"unrecognized arguments: {' '.join(job_args)}")
+    elif args.command == 'serve':
+        serve(args.socket)
+    else:
+        stop(args.socket)
+
+
+if __name__ == "__main__":
+    main()
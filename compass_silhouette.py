@@ -0,0 +1,70 @@
+"""
+compass_silhouette.py
+Purpose: Silhouette score of many clusterings of the same points, as in a sweep over the number of clusters.
+
+The pairwise distances of the points are computed once and kept while they fit in max_bytes; every clustering is
+then scored with a few matrix products (per point, the sum of its distances to each cluster) instead of recomputing
+the distances. Larger inputs are scored chunk by chunk in bounded memory, and sample_size scores a fixed random
+subsample of the points, like the sample_size argument of sklearn.metrics.silhouette_score.
+"""
+
+import numpy as np
+
+# Largest distance matrix kept between scores
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+# Working memory (MiB) of one distance chunk when the matrix is not kept
+WORKING_MEMORY = 64
+
+
+class Silhouette:
+    """ Silhouette scores of clusterings of points, reusing the pairwise distances """
+
+    def __init__(self, points, sample_size=None, max_bytes=DEFAULT_MAX_BYTES, random_state=42):
+        self.points = np.asarray(points)
+        self.indices = np.arange(len(self.points))
+        if sample_size is not None and sample_size < len(self.points):
+            rng = np.random.RandomState(random_state)
+            self.indices = np.sort(rng.choice(len(self.points), sample_size, replace=False))
+        self.max_bytes = max_bytes
+        self._distances = None
+
+    def distances(self):
+        """ Distance matrix of the scored points, None when it does not fit in max_bytes """
+        if self._distances is None and len(self.indices) ** 2 * 8 <= self.max_bytes:
+            from sklearn.metrics import pairwise_distances
+            self._distances = pairwise_distances(self.points[self.indices])
+        return self._distances
+
+    def _cluster_sums(self, one_hot):
+        """ Sum of the distances of every scored point to the points of each cluster """
+        distances = self.distances()
+        if distances is not None:
+            return distances @ one_hot
+        from sklearn.metrics import pairwise_distances_chunked
+        points = self.points[self.indices]
+        chunks = pairwise_distances_chunked(points, working_memory=WORKING_MEMORY,
+                                            reduce_func=lambda chunk, start: chunk @ one_hot)
+        return np.vstack(list(chunks))
+
+    def score(self, labels):
+        """ Mean silhouette coefficient of labels, 0 when the scored points fall in a single cluster """
+        labels = np.asarray(labels)[self.indices]
+        clusters, labels = np.unique(labels, return_inverse=True)
+        if len(clusters) < 2 or len(clusters) >= len(labels):
+            return 0
+        one_hot = np.zeros((len(labels), len(clusters)))
+        one_hot[np.arange(len(labels)), labels] = 1
+        sizes = one_hot.sum(axis=0)
+        sums = self._cluster_sums(one_hot)
+
+        own = np.arange(len(labels)), labels
+        # Mean distance to the other points of the own cluster, and to the nearest other cluster
+        intra = sums[own] / np.maximum(sizes[labels] - 1, 1)
+        means = sums / sizes
+        means[own] = np.inf
+        inter = means.min(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coefficients = np.nan_to_num((inter - intra) / np.maximum(intra, inter))
+        # Points alone in their cluster score 0
+        coefficients[sizes[labels] == 1] = 0
+        return float(coefficients.mean())
@@ -0,0 +1,85 @@
+"""
+compass_sketch.py
+Purpose: Fixed-memory streaming estimate of a column's Shannon entropy (natural log), for columns with too many
+distinct values to count exactly.
+
+The estimator is the stable-distribution sketch of Clifford and Cosma: every distinct value is hashed to k maximally
+skewed 1-stable variates, the registers hold the count-weighted sums of those variates, and
+H ~= -log(mean(exp(registers / N))). The standard error is about sqrt(3 / k) nats, so k is chosen from the requested
+error bound.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+# Number of distinct values turned into variates at once, bounds the temporary (block x k) matrix
+BLOCK_SIZE = 1024
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(x):
+    """ splitmix64 finaliser, vectorized over uint64 arrays """
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _uniform(x):
+    """ Map uint64 hashes to floats strictly inside (0, 1) """
+    return ((x >> np.uint64(11)).astype(np.float64) + 0.5) / float(1 << 53)
+
+
+def stable_variates(hashes, k):
+    """ Deterministic maximally skewed 1-stable variates, one row of k per hash, scaled so that E[exp(X)] = 1 """
+    with np.errstate(over='ignore'):
+        seeds = hashes[:, None] + np.arange(1, k + 1, dtype=np.uint64)[None, :] * _GOLDEN
+        first = _mix(seeds)
+        second = _mix(first ^ _GOLDEN)
+    angle = math.pi * (_uniform(first) - 0.5)
+    weight = -np.log(_uniform(second))
+    shifted = math.pi / 2 - angle
+    return shifted * np.tan(angle) + np.log(weight * np.cos(angle) / shifted)
+
+
+def registers_for_error(epsilon):
+    """ Number of registers whose standard error is epsilon nats """
+    return max(1, math.ceil(3 / (epsilon * epsilon)))
+
+
+class EntropySketch:
+    """ Streaming entropy estimate in k float registers, independent of the number of distinct values """
+
+    def __init__(self, epsilon=0.05):
+        self.epsilon = epsilon
+        self.k = registers_for_error(epsilon)
+        self.registers = np.zeros(self.k)
+        self.total = 0
+
+    def update(self, counts):
+        """ Add a Series of value counts (values in the index) """
+        counts = counts[counts > 0]
+        if counts.empty:
+            return
+        hashes = pd.util.hash_pandas_object(counts.index.to_series(), index=False).to_numpy()
+        weights = counts.to_numpy(dtype=np.float64)
+        for start in range(0, len(hashes), BLOCK_SIZE):
+            block = stable_variates(hashes[start:start + BLOCK_SIZE], self.k)
+            self.registers += weights[start:start + BLOCK_SIZE] @ block
+        self.total += weights.sum()
+
+    def estimate(self):
+        """ Estimated entropy in nats """
+        if self.total == 0:
+            return 0.0
+        scaled = self.registers / self.total
+        # log-mean-exp, shifted by the maximum to stay finite
+        top = scaled.max()
+        return max(0.0, -(top + math.log(np.mean(np.exp(scaled - top)))))
+
+    def standard_error(self):
+        return math.sqrt(3 / self.k)
@@ -0,0 +1,162 @@
+"""
+compass_store.py
+Purpose: Queryable compressed store of a COMPASS column layout, and a benchmark of projected reads against the
+monolithic _full baseline.
+
+A store is a directory with one compressed CSV partition per column cluster and a layout.json naming the columns of
+every partition. Reading a set of columns decompresses and parses only the partitions that hold them. The benchmark
+writes the clusters of COMPASS_KMEANS_DATA or COMPASS_KMEANS_ENTROPY and the full table as two stores, runs the same
+column queries on both and reports, per query, the partitions touched, the compressed and decompressed bytes and
+the best latency.
+
+Usage: compass_store.py input_file.csv [--strategy data|entropy] [--k 3] [--codec gzip] [--query a,b ...]
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+import compass_codecs
+import compass_entropy
+import compass_main
+import compass_recording
+
+LAYOUT_FILE = "layout.json"
+DATA = "data"
+ENTROPY = "entropy"
+
+
+def write_store(df, groups, directory, codec=("gzip", 6)):
+    """ Compress every group of columns of df as one partition of a store in directory """
+    os.makedirs(directory, exist_ok=True)
+    name, level = codec
+    partitions = []
+    for idx, columns in enumerate(groups):
+        data = compass_recording.serialize_partition(df, columns)
+        compressed = compass_codecs.CODECS[name].compress(data, level)
+        file_name = f"partition_{idx + 1}{compass_codecs.label(codec)}"
+        with open(os.path.join(directory, file_name), "wb") as f:
+            f.write(compressed)
+        partitions.append({"file": file_name, "columns": list(columns), "bytes": len(compressed),
+                           "raw_bytes": len(data)})
+    with open(os.path.join(directory, LAYOUT_FILE), "w") as f:
+        json.dump({"codec": [name, level], "rows": len(df), "partitions": partitions}, f, indent=1)
+
+
+class Store:
+    """ Read access to the columns of a store directory """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, LAYOUT_FILE)) as f:
+            layout = json.load(f)
+        self.codec = compass_codecs.CODECS[layout["codec"][0]]
+        self.partitions = layout["partitions"]
+        self.columns = [col for partition in self.partitions for col in partition["columns"]]
+
+    def read(self, columns):
+        """
+        Decompress only the partitions holding columns
+        return : (DataFrame of columns in the requested order, statistics of the read)
+        """
+        missing = [col for col in columns if col not in self.columns]
+        if missing:
+            raise KeyError(f"columns not in the store: {missing}")
+        wanted = set(columns)
+        frames = []
+        stats = {"partitions": 0, "compressed_bytes": 0, "decompressed_bytes": 0}
+        for partition in self.partitions:
+            usecols = [col for col in partition["columns"] if col in wanted]
+            if not usecols:
+                continue
+            with open(os.path.join(self.directory, partition["file"]), "rb") as f:
+                compressed = f.read()
+            data = self.codec.decompress(compressed)
+            frames.append(pd.read_csv(io.BytesIO(data), usecols=usecols))
+            stats["partitions"] += 1
+            stats["compressed_bytes"] += len(compressed)
+            stats["decompressed_bytes"] += len(data)
+        return pd.concat(frames, axis=1)[list(columns)], stats
+
+
+def cluster_layout(df, strategy, n_clusters, entropy_file=None):
+    """ Column groups of COMPASS_KMEANS_DATA or COMPASS_KMEANS_ENTROPY, as split_columns_per_*cluster writes them """
+    if strategy == ENTROPY:
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            if entropy_file is None:
+                entropy_file = os.path.join(scratch_dir, "entropy.csv")
+                compass_entropy.analyze_frame(df, entropy_file)
+            scaled_entropy = compass_main.scale_entropies(entropy_file)
+        clusters = compass_main.cluster_entropies(scaled_entropy, n_clusters, f"COMPASS_KMEANS_ENTROPY ({n_clusters})")
+    else:
+        clusters = compass_main.cluster_features(compass_main.preprocess(df), n_clusters,
+                                                 f"COMPASS_KMEANS_DATA ({n_clusters})")
+    return list(compass_main.group_columns(df.columns, clusters).values())
+
+
+def timed_read(store, columns, repeat):
+    """ Best latency of repeat reads of columns, with the statistics and result of the last one """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result, stats = store.read(columns)
+        best = min(best, time.perf_counter() - start)
+    return best, stats, result
+
+
+def random_queries(columns, count, width, seed=0):
+    rng = random.Random(seed)
+    return [rng.sample(columns, min(width, len(columns))) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark projected reads of a COMPASS layout against _full.')
+    parser.add_argument('input_file', help='Input CSV file or directory of CSV files')
+    parser.add_argument('--strategy', choices=[DATA, ENTROPY], default=ENTROPY, help='Clustering of the layout')
+    parser.add_argument('--k', type=int, default=3, help='Number of clusters')
+    parser.add_argument('--entropy-file', help='Entropy file of the input, computed if not given')
+    parser.add_argument('--codec', default='gzip', help='Codec spec of the partitions, e.g. zstd:3')
+    parser.add_argument('--query', action='append', help='Comma separated columns to read, may be repeated')
+    parser.add_argument('--random-queries', type=int, default=10, help='Random queries when no --query is given')
+    parser.add_argument('--query-width', type=int, default=2, help='Columns per random query')
+    parser.add_argument('--repeat', type=int, default=5, help='Reads per query, the fastest is reported')
+    parser.add_argument('--store-dir', help='Keep the stores in this directory')
+    parser.add_argument('--verify', action='store_true', help='Check that both stores return the same values')
+    args = parser.parse_args()
+    try:
+        codec = compass_codecs.parse_spec(args.codec)[0]
+    except ValueError as e:
+        parser.error(str(e))
+
+    df = compass_main.load_table(args.input_file)
+    groups = cluster_layout(df, args.strategy, args.k, args.entropy_file)
+    queries = [query.split(",") for query in args.query] if args.query else \
+        random_queries(list(df.columns), args.random_queries, args.query_width)
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        store_dir = args.store_dir or scratch_dir
+        layout_name = f"{args.strategy}_k{args.k}"
+        write_store(df, groups, os.path.join(store_dir, layout_name), codec)
+        write_store(df, [list(df.columns)], os.path.join(store_dir, "full"), codec)
+        stores = {layout_name: Store(os.path.join(store_dir, layout_name)),
+                  "full": Store(os.path.join(store_dir, "full"))}
+
+        print("query,layout,partitions,compressed_bytes,decompressed_bytes,latency_s")
+        for query in queries:
+            results = {}
+            for name, store in stores.items():
+                latency, stats, results[name] = timed_read(store, query, args.repeat)
+                print(f'"{" ".join(query)}",{name},{stats["partitions"]},{stats["compressed_bytes"]},'
+                      f'{stats["decompressed_bytes"]},{latency}')
+            if args.verify:
+                pd.testing.assert_frame_equal(results[layout_name], results["full"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+compass_telemetry.py
+Purpose: Per-stage run telemetry of COMPASS as JSON lines.
+
+Every instrumented stage (read, entropy, preprocess, kmeans, silhouette, search, serialize, compress, ...) appends one
+JSON object to the telemetry file when it ends: wall and CPU seconds, CPU seconds of finished child processes, the
+process peak RSS and how much the stage raised it, and the bytes read and written through system calls
+(/proc/self/io, where available). Telemetry is off unless configure() is called or the COMPASS_TELEMETRY environment
+variable names the file, which also enables it in worker processes and in scripts started by the shell runners.
+
+One stage can be profiled: with cProfile its cumulative statistics are written to <telemetry file>.<stage>.prof
+after every occurrence, with tracemalloc the traced peak and the top allocating lines are added to its records.
+
+Usage: compass_telemetry.py telemetry.jsonl [...] summarizes the records per stage.
+"""
+
+import argparse
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import time
+import tracemalloc
+from collections import defaultdict
+
+CPROFILE = "cprofile"
+TRACEMALLOC = "tracemalloc"
+TOP_ALLOCATIONS = 10
+
+_settings = {
+    "path": os.environ.get("COMPASS_TELEMETRY"),
+    "profile_stage": os.environ.get("COMPASS_PROFILE_STAGE"),
+    "profile_mode": os.environ.get("COMPASS_PROFILE_MODE", CPROFILE),
+}
+_profiler = None
+
+
+def configure(path, profile_stage=None, profile_mode=CPROFILE):
+    """ Append stage records to path, in this process and in the processes it starts """
+    _settings.update(path=path, profile_stage=profile_stage, profile_mode=profile_mode)
+    os.environ["COMPASS_TELEMETRY"] = path
+    if profile_stage:
+        os.environ["COMPASS_PROFILE_STAGE"] = profile_stage
+        os.environ["COMPASS_PROFILE_MODE"] = profile_mode
+
+
+def enabled():
+    return bool(_settings["path"])
+
+
+def _io_counters():
+    """ Bytes read and written by this process through system calls, or None outside Linux """
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _snapshot():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "wall": time.perf_counter(),
+        "cpu": self_usage.ru_utime + self_usage.ru_stime,
+        "children_cpu": children_usage.ru_utime + children_usage.ru_stime,
+        # kilobytes on Linux
+        "max_rss": self_usage.ru_maxrss,
+        "io": _io_counters(),
+    }
+
+
+def write_record(record):
+    """ Append one JSON line to the telemetry file """
+    with open(_settings["path"], "a") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+
+@contextlib.contextmanager
+def _measured_stage(name, fields):
+    global _profiler
+    profiled = name == _settings["profile_stage"]
+    if profiled and _settings["profile_mode"] == TRACEMALLOC:
+        tracemalloc.start()
+    elif profiled:
+        _profiler = _profiler or cProfile.Profile()
+        _profiler.enable()
+
+    start = _snapshot()
+    try:
+        yield fields
+    finally:
+        end = _snapshot()
+        record = {
+            "stage": name,
+            "pid": os.getpid(),
+            "time": time.time(),
+            "wall_s": end["wall"] - start["wall"],
+            "cpu_s": end["cpu"] - start["cpu"],
+            "children_cpu_s": end["children_cpu"] - start["children_cpu"],
+            "max_rss_kb": end["max_rss"],
+            "rss_growth_kb": end["max_rss"] - start["max_rss"],
+        }
+        if start["io"] is not None and end["io"] is not None:
+            record["read_bytes"] = end["io"][0] - start["io"][0]
+            record["write_bytes"] = end["io"][1] - start["io"][1]
+        if profiled and _settings["profile_mode"] == TRACEMALLOC:
+            record["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:TOP_ALLOCATIONS]
+            record["top_allocations"] = [str(statistic) for statistic in statistics]
+            tracemalloc.stop()
+        elif profiled:
+            _profiler.disable()
+            _profiler.dump_stats(f"{_settings['path']}.{name}.prof")
+        record.update(fields)
+        write_record(record)
+
+
+def stage(name, **fields):
+    """
+    Context manager recording one stage, a no-op while telemetry is off
+    fields : extra JSON fields of the record (table, label, k, codec, ...); the yielded dict can add more
+    """
+    if not enabled():
+        return contextlib.nullcontext({})
+    return _measured_stage(name, fields)
+
+
+def read_records(paths):
+    records = []
+    for path in paths:
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def summarize(records):
+    """ Per stage: count, total wall, CPU and child CPU seconds, I/O bytes and the largest peak RSS """
+    summary = defaultdict(lambda: {"count": 0, "wall_s": 0.0, "cpu_s": 0.0, "children_cpu_s": 0.0,
+                                   "read_bytes": 0, "write_bytes": 0, "max_rss_kb": 0})
+    for record in records:
+        totals = summary[record["stage"]]
+        totals["count"] += 1
+        for key in ("wall_s", "cpu_s", "children_cpu_s", "read_bytes", "write_bytes"):
+            totals[key] += record.get(key, 0)
+        totals["max_rss_kb"] = max(totals["max_rss_kb"], record["max_rss_kb"])
+    return dict(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize COMPASS telemetry per stage.')
+    parser.add_argument('telemetry_files', nargs='+', help='JSON lines files written with --telemetry')
+    args = parser.parse_args()
+
+    summary = summarize(read_records(args.telemetry_files))
+    print("stage,count,wall_s,cpu_s,children_cpu_s,max_rss_kb,read_bytes,write_bytes")
+    for name, totals in sorted(summary.items(), key=lambda item: item[1]["wall_s"], reverse=True):
+        print(f"{name},{totals['count']},{totals['wall_s']:.6f},{totals['cpu_s']:.6f},{totals['children_cpu_s']:.6f},"
+              f"{totals['max_rss_kb']},{totals['read_bytes']},{totals['write_bytes']}")
+
+
+if __name__ == "__main__":
+    main()
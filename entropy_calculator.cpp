@@ -1,72 +1,281 @@
-#include <iostream>
+// entropy_calculator.cpp
+// Computes the Shannon entropy (natural log) of every column of a CSV file, or of all CSV files in a directory,
+// and writes the column names as a header row followed by one row of entropies, like compass_entropy.analyze.
+//
+// Values are interpreted the way pandas.read_csv does by default: empty fields and the pandas NA strings are
+// missing and not counted, and a column whose values are all integers, all numbers or all booleans is counted by
+// value, so "1" and "1.0" are the same value in a numeric column.
+
+#include <algorithm>
+#include <atomic>
+#include <charconv>
+#include <cerrno>
+#include <cmath>
+#include <cstdint>
+#include <cstdlib>
+#include <filesystem>
 #include <fstream>
+#include <iostream>
+#include <sstream>
+#include <string>
+#include <thread>
 #include <unordered_map>
+#include <unordered_set>
 #include <vector>
-#include <cmath>
-#include <sstream>
 
-std::unordered_map<std::string, double> compute_entropy(const std::string& file_path) {
-    std::ifstream file(file_path);
+namespace fs = std::filesystem;
+
+struct Column {
+    std::string name;
+    std::vector<std::string> values;  // missing values are not stored
+};
+
+static const std::unordered_set<std::string> NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"};
+
+// Split CSV text into records of fields following RFC 4180: quoted fields may contain commas, doubled quotes and
+// line breaks.
+static bool next_record(const std::string& text, size_t& pos, std::vector<std::string>& fields) {
+    fields.clear();
+    if (pos >= text.size()) {
+        return false;
+    }
+    std::string field;
+    bool quoted = false;
+    while (pos < text.size()) {
+        char c = text[pos++];
+        if (quoted) {
+            if (c == '"') {
+                if (pos < text.size() && text[pos] == '"') {
+                    field.push_back('"');
+                    pos++;
+                } else {
+                    quoted = false;
+                }
+            } else {
+                field.push_back(c);
+            }
+        } else if (c == '"') {
+            quoted = true;
+        } else if (c == ',') {
+            fields.push_back(std::move(field));
+            field.clear();
+        } else if (c == '\n' || c == '\r') {
+            if (c == '\r' && pos < text.size() && text[pos] == '\n') {
+                pos++;
+            }
+            break;
+        } else {
+            field.push_back(c);
+        }
+    }
+    fields.push_back(std::move(field));
+    return true;
+}
+
+static bool blank_record(const std::vector<std::string>& fields) {
+    return fields.size() == 1 && fields[0].empty();
+}
+
+static std::string read_file(const std::string& file_path) {
+    std::ifstream file(file_path, std::ios::binary);
     if (!file.is_open()) {
         std::cerr << "Error: Could not open file " << file_path << std::endl;
         exit(1);
     }
+    std::stringstream buffer;
+    buffer << file.rdbuf();
+    return buffer.str();
+}
 
-    std::unordered_map<std::string, std::unordered_map<std::string, int>> column_counts;
-    std::vector<std::string> column_names;
-    std::string line;
+// Append the records of one CSV file to the columns, adding columns that were not seen in earlier files
+static void load_csv(const std::string& file_path, std::vector<Column>& columns,
+                     std::unordered_map<std::string, size_t>& column_index) {
+    std::string text = read_file(file_path);
+    size_t pos = 0;
+    std::vector<std::string> fields;
 
     // Read header
-    if (std::getline(file, line)) {
-        std::stringstream ss(line);
-        std::string column;
-        while (std::getline(ss, column, ',')) {
-            column_names.push_back(column);
-            column_counts[column] = {};
+    if (!next_record(text, pos, fields)) {
+        return;
+    }
+    std::vector<size_t> targets;
+    for (const auto& name : fields) {
+        auto found = column_index.find(name);
+        if (found == column_index.end()) {
+            column_index[name] = columns.size();
+            targets.push_back(columns.size());
+            columns.push_back({name, {}});
+        } else {
+            targets.push_back(found->second);
         }
     }
 
     // Read data
-    while (std::getline(file, line)) {
-        std::stringstream ss(line);
-        std::string value;
-        int col_index = 0;
-        while (std::getline(ss, value, ',')) {
-            column_counts[column_names[col_index]][value]++;
-            col_index++;
+    while (next_record(text, pos, fields)) {
+        if (blank_record(fields)) {
+            continue;
+        }
+        for (size_t i = 0; i < fields.size() && i < targets.size(); i++) {
+            if (NA_VALUES.count(fields[i]) == 0) {
+                columns[targets[i]].values.push_back(std::move(fields[i]));
+            }
         }
     }
+}
+
+static bool parse_int(const std::string& s, long long& out) {
+    const char* begin = s.data();
+    const char* end = begin + s.size();
+    if (begin != end && *begin == '+') {
+        begin++;
+    }
+    auto result = std::from_chars(begin, end, out);
+    return result.ec == std::errc() && result.ptr == end && begin != end;
+}
 
-    file.close();
+static bool parse_double(const std::string& s, double& out) {
+    if (s.empty()) {
+        return false;
+    }
+    char* end = nullptr;
+    errno = 0;
+    out = std::strtod(s.c_str(), &end);
+    return end == s.c_str() + s.size();
+}
 
-    // Compute entropy for each column
-    std::unordered_map<std::string, double> entropy_values;
-    for (const auto& col : column_counts) {
-        double entropy = 0.0;
-        int total = 0;
-        for (const auto& val : col.second) {
-            total += val.second;
-        }
-        for (const auto& val : col.second) {
-            double p = static_cast<double>(val.second) / total;
-            entropy -= p * std::log2(p);
+static bool parse_bool(const std::string& s, bool& out) {
+    if (s == "True" || s == "TRUE" || s == "true") {
+        out = true;
+        return true;
+    }
+    if (s == "False" || s == "FALSE" || s == "false") {
+        out = false;
+        return true;
+    }
+    return false;
+}
+
+template <typename Key>
+static double entropy_of(const std::vector<Key>& keys) {
+    std::unordered_map<Key, long long> counts;
+    for (const auto& key : keys) {
+        counts[key]++;
+    }
+    double total = static_cast<double>(keys.size());
+    double entropy = 0.0;
+    for (const auto& count : counts) {
+        double p = static_cast<double>(count.second) / total;
+        entropy -= p * std::log(p);
+    }
+    return entropy;
+}
+
+// Parse every value of a column with parse, or return false if one of them does not parse
+template <typename Key, typename Parser>
+static bool typed_keys(const Column& column, Parser parse, std::vector<Key>& keys) {
+    keys.reserve(column.values.size());
+    for (const auto& value : column.values) {
+        Key key;
+        if (!parse(value, key)) {
+            keys.clear();
+            return false;
         }
-        entropy_values[col.first] = entropy;
+        keys.push_back(key);
     }
+    return true;
+}
 
-    return entropy_values;
+static double column_entropy(const Column& column) {
+    if (column.values.empty()) {
+        return 0.0;
+    }
+    std::vector<long long> ints;
+    if (typed_keys(column, parse_int, ints)) {
+        return entropy_of(ints);
+    }
+    std::vector<double> doubles;
+    if (typed_keys(column, parse_double, doubles)) {
+        return entropy_of(doubles);
+    }
+    std::vector<bool> bools;
+    if (typed_keys(column, parse_bool, bools)) {
+        return entropy_of(bools);
+    }
+    return entropy_of(column.values);
+}
+
+// Format like Python's repr(float): shortest round-trip digits, with ".0" on integral values
+static std::string format_double(double value) {
+    char buffer[64];
+    auto result = std::to_chars(buffer, buffer + sizeof(buffer), value);
+    std::string text(buffer, result.ptr);
+    if (text.find_first_of(".eEn") == std::string::npos) {
+        text += ".0";
+    }
+    return text;
+}
+
+// Quote a field like Python's csv.writer with QUOTE_MINIMAL
+static std::string csv_field(const std::string& field) {
+    if (field.find_first_of(",\"\r\n") == std::string::npos) {
+        return field;
+    }
+    std::string quoted = "\"";
+    for (char c : field) {
+        if (c == '"') {
+            quoted.push_back('"');
+        }
+        quoted.push_back(c);
+    }
+    quoted.push_back('"');
+    return quoted;
 }
 
 int main(int argc, char* argv[]) {
-    if (argc != 3) {
-        std::cerr << "Usage: " << argv[0] << " <input_csv> <output_csv>" << std::endl;
+    if (argc != 3 && argc != 4) {
+        std::cerr << "Usage: " << argv[0] << " <input_csv or directory> <output_csv> [threads]" << std::endl;
         return 1;
     }
 
     std::string input_file = argv[1];
     std::string output_file = argv[2];
+    unsigned threads = argc == 4 ? static_cast<unsigned>(std::atoi(argv[3])) : std::thread::hardware_concurrency();
+    threads = std::max(1u, threads);
 
-    std::unordered_map<std::string, double> entropies = compute_entropy(input_file);
+    std::vector<Column> columns;
+    std::unordered_map<std::string, size_t> column_index;
+    if (fs::is_directory(input_file)) {
+        // Files are read in name order, as compass_ingest.csv_files lists them, so the columns come in the same order
+        std::vector<std::string> files;
+        for (const auto& entry : fs::directory_iterator(input_file)) {
+            if (entry.is_regular_file() && entry.path().extension() == ".csv") {
+                files.push_back(entry.path().string());
+            }
+        }
+        std::sort(files.begin(), files.end());
+        for (const auto& file : files) {
+            load_csv(file, columns, column_index);
+        }
+    } else {
+        load_csv(input_file, columns, column_index);
+    }
+
+    // Compute entropy for each column, columns are shared out between the threads
+    std::vector<double> entropies(columns.size(), 0.0);
+    std::atomic<size_t> next_column(0);
+    std::vector<std::thread> workers;
+    for (unsigned t = 0; t < std::min<size_t>(threads, columns.size()); t++) {
+        workers.emplace_back([&]() {
+            for (size_t i = next_column++; i < columns.size(); i = next_column++) {
+                entropies[i] = column_entropy(columns[i]);
+            }
+        });
+    }
+    for (auto& worker : workers) {
+        worker.join();
+    }
 
     std::ofstream out(output_file);
     if (!out.is_open()) {
@@ -74,9 +283,14 @@ int main(int argc, char* argv[]) {
         return 1;
     }
 
-    for (const auto& e : entropies) {
-        out << e.first << "," << e.second << std::endl;
+    for (size_t i = 0; i < columns.size(); i++) {
+        out << (i ? "," : "") << csv_field(columns[i].name);
+    }
+    out << "\n";
+    for (size_t i = 0; i < columns.size(); i++) {
+        out << (i ? "," : "") << format_double(entropies[i]);
     }
+    out << "\n";
 
     out.close();
     std::cout << "Entropy values saved to " << output_file << std::endl;
@@ -20,11 +20,9 @@ fi
 
 python3 sibaco_entropy.py "$input_file" "$entropy_file"
 
-# Iterate over cluster sizes from 2 to 16
-for ((i=2; i<=num_clusters; i++)); do
-    echo "Running program for cluster size $i..."
-    python3 compass_main.py "$input_file" "$entropy_file" "$results_file" "$i"
-done
+# Sweep cluster sizes from 2 to num_clusters in a single process, on the resident server if one is running
+# (python3 compass_server.py serve), else as python3 compass_main.py
+python3 compass_server.py run "$input_file" "$entropy_file" "$results_file" --k-range "2:$num_clusters"
 
 echo "Program execution complete."
 
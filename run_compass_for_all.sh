@@ -1,13 +1,6 @@
 #!/bin/bash
 
-# Loop through each CSV file in the envmondb directory
-for file in envmondb/*.csv; do
-    # Extract filename without extension
-    filename=$(basename "$file" .csv)
-    
-    # Get the number of columns by counting commas in the first row
-    num_columns=$(head -n 1 "$file" | tr -cd ',' | wc -c)
-    ((num_columns++))  # Add 1 to include the last column
-    # Run the command for each file
-    ./run_compass_experiments.sh "$file" "entropy_${filename}_file.csv" "results_${filename}.csv" "$num_columns" &> "compass_${filename}.log"
-done
+# Run COMPASS on every CSV file in the envmondb directory, largest tables first on all cores.
+# Finished (table, k) jobs are recorded in compass_manifest.json, so running this again resumes an interrupted sweep.
+# Writes results_<table>.csv, compass_<table>.log and entropy_<table>_file.csv for every table.
+python3 compass_runner.py envmondb --out-dir . "$@"
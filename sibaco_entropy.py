@@ -5,18 +5,17 @@ Purpose: This script reads a CSV file and generates the Shannon's entropy for ea
 """
 
 import csv
-import glob
-import os
-
-from scipy.stats import entropy
 import sys
-import pandas as pd
 import subprocess
 
+import compass_entropy
+from compass_entropy import entropy
+import compass_ingest
+
 
 def usage():
     """ Print usage and exit """
-    print("Usage: sibaco_entropy.py input_file.csv results.csv")
+    print("Usage: sibaco_entropy.py input_file.csv results.csv [chunk size]")
     sys.exit()
 
 
@@ -26,22 +25,13 @@ def shannon_entropy(col):
     return entropy_value
 
 
-def analyze(infpath, outfpath):
-    """ Analyse input file, write output file """
-    df = []
-    if os.path.isdir(input_file):
-        # Get CSV files list from a folder
-        csv_files = glob.glob(input_file + "/*.csv")
-
-        # Read each CSV file into DataFrame
-        # This creates a list of dataframes
-        df_list = (pd.read_csv(file) for file in csv_files)
-
-        # Concatenate all DataFrames
-        df = pd.concat(df_list, ignore_index=True)
-    if os.path.isfile(input_file):
-        df = pd.read_csv(infpath, sep=',', header=0)
+def analyze(infpath, outfpath, chunksize=None):
+    """ Analyse input file, write output file; a chunksize streams the input instead of loading it whole """
+    if chunksize:
+        compass_entropy.analyze_chunks(infpath, outfpath, chunksize)
+        return
 
+    df = compass_ingest.read_table(infpath)
     entropies = {col: shannon_entropy(df[col]) for col in df}
     # Write output
     with open(outfpath, 'w') as ouf:
@@ -52,17 +42,18 @@ def analyze(infpath, outfpath):
 
 
 def analyze_C(input_file, outfpath):
-    """ Call the C++ entropy calculator """
-    cpp_executable = "./entropy_calculator"  # Ensure the compiled C++ executable is present
+    """ Call the C++ entropy calculator, falling back to the Python analysis if it fails or is not built """
     try:
-        subprocess.run([cpp_executable, input_file, outfpath], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error running entropy calculator: {e}")
+        compass_entropy.analyze_native(input_file, outfpath)
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"Error running entropy calculator: {e}, analysing in Python")
+        analyze(input_file, outfpath)
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
+    if len(sys.argv) not in (3, 4):
         usage()
     input_file, output_file = sys.argv[1], sys.argv[2]
+    chunk_rows = int(sys.argv[3]) if len(sys.argv) == 4 else None
     print("Analysing {} and writing {}".format(input_file, output_file))
-    analyze(input_file, output_file)
+    analyze(input_file, output_file, chunk_rows)